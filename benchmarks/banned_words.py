@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Micro-benchmark of the banned words moderator with a long list of words.
+
+Compares the trie-shaped regular expression to checking the words one by one
+and to a plain alternation of all the words.
+
+Run it from the repository root: python -m benchmarks.banned_words
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+import timeit
+
+from twason.moderator import BannedWordsModerator, ModerationDecision, normalize
+
+MESSAGES = [
+    "hello everyone, how are you doing today?",
+    "THIS GAME IS SO GOOD I CAN'T BELIEVE IT",
+    "gg wp",
+    "Did you see that? That was AMAZING",
+    "ça va très bien, merci à toi et à la modération",
+    "🔥🔥🔥🔥🔥 LET'S GO 🔥🔥🔥🔥🔥",
+    "you are such a n00b lol",
+    "check my stream on twitch.tv/somebody",
+]
+# Long runs of the letters of the banned words with repeated letters, which made
+# the matcher backtrack exponentially when each letter could be repeated
+PATHOLOGICAL_MESSAGES = ["a" * 400 + "z", "k" * 400 + "z", "aaab" * 100]
+
+
+def generate_words(count: int) -> [str]:
+    rng = random.Random(42)
+    words = {"noob", "aaaa", "kkk"}
+    while len(words) < count:
+        words.add(
+            "".join(
+                rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12))
+            )
+        )
+    return sorted(words)
+
+
+def measure(vote, number: int, messages: [str] = MESSAGES) -> float:
+    duration = min(
+        timeit.repeat(lambda: [vote(msg) for msg in messages], number=number, repeat=5)
+    )
+    return duration / (number * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--words", type=int, default=10000)
+    args = parser.parse_args()
+
+    words = generate_words(args.words)
+
+    start = time.perf_counter()
+    moderator = BannedWordsModerator(
+        "{author}, watch your language!",
+        ModerationDecision.DELETE_MSG,
+        None,
+        words,
+        False,
+        [],
+    )
+    print(
+        "%d words compiled in %.1f ms"
+        % (len(words), (time.perf_counter() - start) * 1e3)
+    )
+
+    naive = [re.compile(r"(?<!\w)%s(?!\w)" % re.escape(word)) for word in words]
+    alternation = re.compile(r"(?<!\w)(?:%s)(?!\w)" % "|".join(map(re.escape, words)))
+
+    print(
+        "%-12s %9.3f µs/message"
+        % ("trie", measure(lambda msg: moderator.vote(msg, "author"), 2000))
+    )
+    print(
+        "%-12s %9.3f µs/message"
+        % (
+            "pathological",
+            measure(
+                lambda msg: moderator.vote(msg, "author"), 200, PATHOLOGICAL_MESSAGES
+            ),
+        )
+    )
+    print(
+        "%-12s %9.3f µs/message"
+        % (
+            "alternation",
+            measure(lambda msg: alternation.search(normalize(msg)), 20),
+        )
+    )
+    print(
+        "%-12s %9.3f µs/message"
+        % (
+            "one by one",
+            measure(
+                lambda msg: any(
+                    pattern.search(normalized)
+                    for normalized in (normalize(msg),)
+                    for pattern in naive
+                ),
+                2,
+            ),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Micro-benchmark of the Caps Lock moderator.
+
+Run it from the repository root: python -m benchmarks.caps_lock
+"""
+
+import timeit
+
+from twason.moderator import CapsLockModerator, ModerationDecision
+
+MESSAGES = {
+    "ascii": [
+        "hello everyone, how are you doing today?",
+        "THIS GAME IS SO GOOD I CAN'T BELIEVE IT",
+        "gg wp",
+        "Did you see that? That was AMAZING",
+        "lol",
+    ],
+    "accented": [
+        "ça va très bien, merci à toi et à la modération",
+        "ÉNORME CETTE PARTIE, FÉLICITATIONS À TOUS",
+        "Où est passé le boss ? Il était là à l'instant",
+        "ÜBERRASCHUNG! Schöne Grüße aus München",
+    ],
+    "emotes": [
+        "🔥🔥🔥🔥🔥 LET'S GO 🔥🔥🔥🔥🔥",
+        "😂😂😂😂😂😂😂😂😂😂😂😂",
+        "PogChamp 🎉🎉 what a play 🎉🎉 PogChamp",
+        "👀 👀 👀 sus 👀 👀 👀",
+    ],
+}
+
+
+def main():
+    moderator = CapsLockModerator(
+        "{author}, stop the caps lock!", ModerationDecision.DELETE_MSG, None, 5, 50
+    )
+
+    for category, messages in MESSAGES.items():
+        number = 100000 // len(messages)
+        duration = min(
+            timeit.repeat(
+                lambda: [moderator.vote(msg, "author") for msg in messages],
+                number=number,
+                repeat=5,
+            )
+        )
+        print(
+            "%-10s %7.3f µs/message"
+            % (category, duration / (number * len(messages)) * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""A local IRC server answering like Twitch's chat, to run the bot against.
+
+It speaks the part of the protocol the bot uses: the twitch.tv/tags and
+twitch.tv/commands capabilities, JOIN, tagged PRIVMSG, raids, RECONNECT,
+and the /delete and /timeout commands. Like Twitch, it drops the messages
+sent beyond the rate limits. It can also generate chat at thousands of
+messages per second, with some spam among it to measure how long the bot
+takes to delete it.
+
+Run it alone from the repository root, then start the bot with
+--server=127.0.0.1:6667 --no-tls: python -m benchmarks.fake_twitch
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from collections import deque
+
+SERVER_NAME = "tmi.twitch.tv"
+
+# Twitch's limits of messages sent in a channel, and of channels joined
+RATE_LIMIT_PERIOD = 30
+RATE_LIMIT = 20
+MODERATOR_RATE_LIMIT = 100
+JOIN_RATE_LIMIT = 20
+JOIN_RATE_LIMIT_PERIOD = 10
+
+CHAT_WORDS = [
+    "hello", "gg", "what", "a", "play", "lol", "this", "is", "so", "good",
+    "ça", "marche", "très", "bien", "nice", "stream", "🔥", "😂", "Kappa",
+]  # fmt: skip
+SPAM_WORD = "spamword"
+
+
+def tags(author: str, **extra) -> str:
+    values = {
+        "badge-info": "",
+        "badges": "",
+        "color": "#FF4500",
+        "display-name": author,
+        "emotes": "",
+        "first-msg": "0",
+        "flags": "",
+        "id": str(uuid.uuid4()),
+        "mod": "0",
+        "room-id": "1337",
+        "subscriber": "0",
+        "tmi-sent-ts": str(int(time.time() * 1000)),
+        "turbo": "0",
+        "user-id": "1337",
+        "user-type": "",
+        **extra,
+    }
+    return ";".join("%s=%s" % item for item in values.items())
+
+
+def privmsg(channel: str, author: str, message: str, **extra) -> str:
+    return "@%s :%s!%s@%s.tmi.twitch.tv PRIVMSG #%s :%s" % (
+        tags(author, **extra),
+        author,
+        author,
+        author,
+        channel,
+        message,
+    )
+
+
+def percentile(values: [float], percent: int) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class Client:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.nick = None
+        self.capabilities = set()
+        self.channels = set()
+        # When the last messages and JOINs were received, within the rate limits
+        self.sent_at = deque()
+        self.joined_at = deque()
+
+    def send(self, *lines: str):
+        self.writer.write("".join("%s\r\n" % line for line in lines).encode())
+
+    def send_tagged(self, line: str):
+        """Send a line starting with tags, without them if the client
+        has not requested them."""
+        if "twitch.tv/tags" not in self.capabilities and line.startswith("@"):
+            line = line.split(" ", 1)[1]
+        self.send(line)
+
+    def within_limit(self, times: deque, limit: int, period: float) -> bool:
+        now = time.monotonic()
+        while times and now - times[0] >= period:
+            times.popleft()
+        if len(times) >= limit:
+            return False
+
+        times.append(now)
+        return True
+
+
+class FakeTwitchServer:
+    """Log the clients in whatever their token, and relay the chat generated
+    in the channels they join."""
+
+    def __init__(self, rate_limit: int = MODERATOR_RATE_LIMIT):
+        self.rate_limit = rate_limit
+        self.server = None
+        self.port = None
+        self.clients = []
+        self.handlers = set()
+        # When each channel has been joined, as given by time.perf_counter()
+        self.joined_at = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.chat_sent = 0
+        # The channel, author and sending time of the spam messages
+        # waiting to be deleted, by id
+        self.spam_sent_at = {}
+        self.spam_sent = 0
+        # The time taken by the bot to delete each spam message
+        self.delete_latencies = []
+        self.timeouts = 0
+        self.messages = 0
+        self.dropped = 0
+        self.dropped_joins = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        self.server.close()
+        for client in self.clients:
+            client.writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = Client(writer)
+        self.clients.append(client)
+        self.handlers.add(asyncio.current_task())
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                self.receive(client, line.decode("utf-8", "replace").rstrip("\r\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.remove(client)
+            self.handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def receive(self, client: Client, line: str):
+        command, _, params = line.partition(" ")
+
+        if command == "NICK":
+            client.nick = nick = params.lower()
+            client.send(
+                ":%s 001 %s :Welcome, GLHF!" % (SERVER_NAME, nick),
+                ":%s 375 %s :-" % (SERVER_NAME, nick),
+                ":%s 372 %s :You are in a maze of twisty passages."
+                % (SERVER_NAME, nick),
+                ":%s 376 %s :>" % (SERVER_NAME, nick),
+            )
+        elif command == "CAP":
+            capabilities = params.split(":", 1)[1]
+            client.capabilities.update(capabilities.split())
+            client.send(":%s CAP * ACK :%s" % (SERVER_NAME, capabilities))
+        elif command == "PING":
+            client.send(":%s PONG %s %s" % (SERVER_NAME, SERVER_NAME, params))
+        elif command == "JOIN":
+            for channel in params.split(","):
+                if not client.within_limit(
+                    client.joined_at, JOIN_RATE_LIMIT, JOIN_RATE_LIMIT_PERIOD
+                ):
+                    self.dropped_joins += 1
+                    continue
+
+                client.channels.add(channel[1:])
+                client.send(
+                    ":{0}!{0}@{0}.{1} JOIN {2}".format(
+                        client.nick, SERVER_NAME, channel
+                    ),
+                    ":{0}.{1} 353 {0} = {2} :{0}".format(
+                        client.nick, SERVER_NAME, channel
+                    ),
+                    ":{0}.{1} 366 {0} {2} :End of /NAMES list".format(
+                        client.nick, SERVER_NAME, channel
+                    ),
+                )
+                self.joined_at.setdefault(channel[1:], time.perf_counter())
+        elif command == "PART":
+            client.channels.discard(params[1:])
+            client.send(
+                ":{0}!{0}@{0}.{1} PART {2}".format(client.nick, SERVER_NAME, params)
+            )
+        elif command == "PRIVMSG":
+            channel, _, message = params.partition(" :")
+            self.receive_message(client, channel[1:], message)
+
+    def receive_message(self, client: Client, channel: str, message: str):
+        if not client.within_limit(client.sent_at, self.rate_limit, RATE_LIMIT_PERIOD):
+            self.dropped += 1
+            return
+
+        if message.startswith("/delete "):
+            spam = self.spam_sent_at.pop(message[8:].strip(), None)
+            if spam is not None:
+                self.delete_latencies.append(time.perf_counter() - spam[2])
+        elif message.startswith("/timeout "):
+            self.timeouts += 1
+            # Timing a chatter out deletes all their messages too
+            author = message.split(" ", 2)[1]
+            for message_id, spam in list(self.spam_sent_at.items()):
+                if spam[:2] == (channel, author):
+                    del self.spam_sent_at[message_id]
+                    self.delete_latencies.append(time.perf_counter() - spam[2])
+        else:
+            self.messages += 1
+
+    def broadcast(self, channel: str, line: str):
+        for client in self.clients:
+            if channel in client.channels:
+                client.send_tagged(line)
+
+    def chat(self, channel: str, author: str, message: str, **extra) -> str:
+        """Send a message in the channel, and return its id."""
+        message_id = str(uuid.uuid4())
+        self.broadcast(
+            channel, privmsg(channel, author, message, id=message_id, **extra)
+        )
+        self.chat_sent += 1
+        return message_id
+
+    def spam(self, channel: str, author: str):
+        """Send a message the bot has to delete, and measure how long it takes."""
+        message_id = self.chat(channel, author, "buy %s now" % SPAM_WORD)
+        self.spam_sent_at[message_id] = (channel, author, time.perf_counter())
+        self.spam_sent += 1
+
+    def raid(self, channel: str, raider: str, viewers: int = 100):
+        line = "@%s :%s USERNOTICE #%s" % (
+            tags(raider, **{"msg-id": "raid", "msg-param-viewerCount": viewers}),
+            SERVER_NAME,
+            channel,
+        )
+        for client in self.clients:
+            if (
+                channel in client.channels
+                and "twitch.tv/commands" in client.capabilities
+            ):
+                client.send_tagged(line)
+
+    def reconnect(self, grace: float = 5):
+        """Ask the clients to reconnect, and close their connection after
+        the grace period, as Twitch does before restarting a server."""
+        clients = [
+            client
+            for client in self.clients
+            if "twitch.tv/commands" in client.capabilities
+        ]
+        for client in clients:
+            client.send(":%s RECONNECT" % SERVER_NAME)
+
+        loop = asyncio.get_running_loop()
+        for client in clients:
+            loop.call_later(grace, client.writer.close)
+
+    async def generate_load(
+        self,
+        channels: [str],
+        rate: float,
+        duration: float,
+        spam_rate: float = 1,
+        nb_authors: int = 5000,
+        tick: float = 0.01,
+    ):
+        """Send `rate` messages per second in the channels for `duration`
+        seconds, `spam_rate` of them being spam."""
+        rng = random.Random(42)
+        authors = ["viewer%d" % i for i in range(nb_authors)]
+        started_at = time.perf_counter()
+        chat_sent = spam_sent = 0
+
+        while True:
+            elapsed = time.perf_counter() - started_at
+            if elapsed >= duration:
+                break
+
+            # Catch up with the messages that should have been sent by now
+            nb_chat = int(elapsed * (rate - spam_rate)) - chat_sent
+            nb_spam = int(elapsed * spam_rate) - spam_sent
+            chat_sent += nb_chat
+            spam_sent += nb_spam
+
+            for _ in range(nb_chat):
+                self.chat(
+                    rng.choice(channels),
+                    rng.choice(authors),
+                    " ".join(rng.choices(CHAT_WORDS, k=rng.randint(1, 12))),
+                )
+            for _ in range(nb_spam):
+                self.spam(rng.choice(channels), rng.choice(authors))
+
+            await asyncio.sleep(tick)
+
+    def print_stats(self, duration: float):
+        latencies = [latency * 1000 for latency in self.delete_latencies]
+        for name, value in (
+            ("chat_messages_per_second", self.chat_sent / duration),
+            ("spam_sent", self.spam_sent),
+            ("spam_deleted", len(latencies)),
+            ("delete_latency_p50_ms", percentile(latencies, 50)),
+            ("delete_latency_p99_ms", percentile(latencies, 99)),
+            ("delete_latency_max_ms", max(latencies, default=0.0)),
+            ("timeouts", self.timeouts),
+            ("bot_messages", self.messages),
+            ("dropped_by_rate_limit", self.dropped),
+            ("dropped_joins", self.dropped_joins),
+        ):
+            print("%-28s %12.2f" % (name, value))
+
+
+async def serve(args: argparse.Namespace):
+    server = FakeTwitchServer(args.rate_limit)
+    await server.start(args.host, args.port)
+    print("Listening on %s:%d" % (args.host, server.port))
+
+    while True:
+        # Wait for a bot to join the channels
+        while not server.clients or not any(
+            client.channels for client in server.clients
+        ):
+            await asyncio.sleep(0.1)
+
+        channels = sorted(set().union(*(client.channels for client in server.clients)))
+        await server.generate_load(channels, args.rate, args.interval, args.spam_rate)
+        server.print_stats(args.interval)
+        print()
+        server.reset_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument(
+        "--rate", type=float, default=1000, help="the chat messages sent per second"
+    )
+    parser.add_argument(
+        "--spam-rate",
+        type=float,
+        default=1,
+        help="the spam messages sent per second, among the chat messages",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=MODERATOR_RATE_LIMIT,
+        help="the messages a client can send every 30 seconds",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10, help="print the stats every N seconds"
+    )
+
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
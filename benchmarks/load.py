@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""End-to-end load test of the bot.
+
+Starts the bot in new processes against a local fake Twitch server, sends
+chat at the given rate in its channels, with some spam among it, and measures
+the time between each spam message and the /delete the bot sends for it.
+
+Run it from the repository root: python -m benchmarks.load
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_twitch import FakeTwitchServer, SPAM_WORD
+
+
+async def run(args: argparse.Namespace) -> FakeTwitchServer:
+    server = FakeTwitchServer()
+    port = await server.start()
+    channels = ["load%d" % i for i in range(args.channels)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(
+                {
+                    "nickname": "loadbot",
+                    "bot_is_moderator": True,
+                    "channels": [{"channel": channel} for channel in channels],
+                    "moderator": {
+                        "caps-lock": {},
+                        "flood": {"max-msg-occurrences": 3},
+                        "banned-words": {"words": [SPAM_WORD]},
+                    },
+                },
+                config_file,
+            )
+
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "twason",
+                "--config",
+                config_path,
+                "--workers",
+                str(args.workers),
+                "--server",
+                "127.0.0.1:%d" % port,
+                "--no-tls",
+                "--state-interval",
+                "0",
+                "--log-level",
+                "warning",
+            ],
+            env={**os.environ, "TWITCH_TOKEN": "oauth:load"},
+        )
+
+        try:
+            started_at = time.perf_counter()
+            while len(server.joined_at) < len(channels):
+                if time.perf_counter() - started_at > 30:
+                    raise TimeoutError("the bot has not joined the channels")
+                await asyncio.sleep(0.01)
+
+            await server.generate_load(
+                channels, args.rate, args.duration, args.spam_rate
+            )
+            # Give the bot the time to handle the last messages
+            await asyncio.sleep(1)
+        finally:
+            # The supervisor only stops its workers on SIGINT
+            process.send_signal(signal.SIGINT)
+            await asyncio.get_running_loop().run_in_executor(None, process.wait)
+            await server.stop()
+
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rate", type=float, default=2000, help="the chat messages sent per second"
+    )
+    parser.add_argument(
+        "--spam-rate",
+        type=float,
+        default=1,
+        help="the spam messages sent per second, among the chat messages "
+        "(the bot can only send 100 messages every 30 seconds)",
+    )
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--channels", "-c", type=int, default=3)
+    parser.add_argument("--workers", "-w", type=int, default=1)
+    args = parser.parse_args()
+
+    server = asyncio.run(run(args))
+    server.print_stats(args.duration)
+    return 0 if len(server.delete_latencies) == server.spam_sent else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Throughput and latency benchmark of the bot.
+
+Raw Twitch IRC lines, either read from a file or generated, are fed through
+the bot plugin with a fake connection. The results are compared to the
+baseline stored in benchmarks/baseline.json.
+
+Run it from the repository root: python -m benchmarks.replay
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from benchmarks.fake_twitch import privmsg, tags
+from twason import log
+from twason import twitchbot
+from twason.config import Config
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+CONFIG = {
+    "nickname": "benchbot",
+    "channels": [{"channel": "bench%d" % i} for i in range(3)],
+    "bot_is_moderator": True,
+    "commands": [
+        {"name": "cmd%d" % i, "aliases": ["alias%d" % i], "message": "Answer %d" % i}
+        for i in range(200)
+    ],
+    "timer": {
+        "between": {"time": 1, "messages": 10},
+        "pool": [{"message": "Timer message %d" % i} for i in range(5)],
+    },
+    "moderator": {
+        "caps-lock": {"activate": True, "min-size": 5, "threshold": 50},
+        "flood": {
+            "activate": True,
+            "duration": 5,
+            "max-word-length": 40,
+            "raid-cooldown": 1,
+            "max-msg-occurrences": 3,
+            "min-time-between-occurrence": 30,
+        },
+    },
+}
+
+WORDS = [
+    "hello", "gg", "what", "a", "play", "lol", "this", "is", "so", "good",
+    "ça", "marche", "très", "bien", "LET'S", "GO", "nice", "stream", "🔥", "😂",
+]  # fmt: skip
+EMOTES = ["Kappa", "PogChamp", "LUL", "Kreygasm", "BibleThump"]
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, data: str):
+        self.lines += data.count("\r\n") + 1
+
+    def close(self):
+        pass
+
+
+def emote_spam(nb_emotes: int) -> (str, str):
+    words, positions, position = [], {}, 0
+    for _ in range(nb_emotes):
+        emote = random.choice(EMOTES)
+        positions.setdefault(emote, []).append(
+            "%d-%d" % (position, position + len(emote) - 1)
+        )
+        words.append(emote)
+        position += len(emote) + 1
+
+    emotes = "/".join(
+        "%d:%s" % (EMOTES.index(emote) + 25, ",".join(indices))
+        for emote, indices in positions.items()
+    )
+    return " ".join(words), emotes
+
+
+def generate_lines(count: int, seed: int = 42) -> [str]:
+    random.seed(seed)
+    channels = [channel["channel"] for channel in CONFIG["channels"]]
+    authors = ["viewer%d" % i for i in range(2000)]
+    lines = []
+
+    for i in range(count):
+        channel = random.choice(channels)
+        author = random.choice(authors)
+        kind = random.random()
+
+        if kind < 0.6:
+            message = " ".join(random.choices(WORDS, k=random.randint(1, 15)))
+            lines.append(privmsg(channel, author, message))
+        elif kind < 0.7:
+            lines.append(privmsg(channel, author, "!cmd%d" % random.randint(0, 250)))
+        elif kind < 0.8:
+            message = " ".join(random.choices(WORDS, k=8)).upper()
+            lines.append(privmsg(channel, author, message))
+        elif kind < 0.9:
+            message, emotes = emote_spam(random.randint(10, 50))
+            lines.append(privmsg(channel, author, message, emotes=emotes))
+        elif kind < 0.999:
+            lines.extend(
+                privmsg(channel, author, "buy followers at example.com")
+                for _ in range(3)
+            )
+        else:
+            lines.append(
+                "@%s :tmi.twitch.tv USERNOTICE #%s"
+                % (tags(author, **{"msg-id": "raid"}), channel)
+            )
+
+    return lines[:count]
+
+
+def create_bot() -> (twitchbot.TwitchBot, asyncio.AbstractEventLoop):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    bot = twitchbot.create_bot(Config.from_dict(CONFIG, "token"))
+    bot.protocol = FakeConnection()
+
+    return bot, loop
+
+
+def close(loop: asyncio.AbstractEventLoop):
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def handle(bot, loop, line: str):
+    bot.dispatch(line)
+    # Run the handlers irc3 scheduled for this line
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+
+
+def measure_latencies(lines: [str]) -> (float, [int]):
+    bot, loop = create_bot()
+    latencies = []
+
+    started_at = time.perf_counter()
+    for line in lines:
+        line_started_at = time.perf_counter_ns()
+        handle(bot, loop, line)
+        latencies.append(time.perf_counter_ns() - line_started_at)
+    duration = time.perf_counter() - started_at
+
+    close(loop)
+    return duration, latencies
+
+
+def measure_allocations(lines: [str]) -> int:
+    """Return the memory allocated while handling each line, summed up."""
+    bot, loop = create_bot()
+    allocated = 0
+
+    tracemalloc.start()
+    for line in lines:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        handle(bot, loop, line)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    close(loop)
+    return allocated
+
+
+def run(lines: [str], repeat: int) -> {str: float}:
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        log.setup()
+        # Keep the fastest run, the slower ones being disturbed by the system
+        duration, latencies = min(
+            (measure_latencies(lines) for _ in range(repeat)),
+            key=lambda result: result[0],
+        )
+        # Tracing the allocations slows everything down, so do it separately
+        allocated = measure_allocations(lines)
+        log.stop()
+
+    latencies.sort()
+    return {
+        "messages_per_second": len(lines) / duration,
+        "p50_latency_us": latencies[len(latencies) // 2] / 1000,
+        "p99_latency_us": latencies[len(latencies) * 99 // 100] / 1000,
+        "allocated_bytes_per_message": allocated / len(lines),
+    }
+
+
+def compare(results: {str: float}, baseline: {str: float}, tolerance: float) -> bool:
+    ok = True
+
+    for key, value in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print("%-28s %12.2f" % (key, value))
+            continue
+
+        change = (value - reference) / reference * 100
+        # Only the throughput is better when higher
+        worse = -change if key == "messages_per_second" else change
+        regression = worse > tolerance
+        ok = ok and not regression
+        print(
+            "%-28s %12.2f  (baseline: %.2f, %+.1f%%)%s"
+            % (key, value, reference, change, "  REGRESSION" if regression else "")
+        )
+
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=str,
+        help="a file of raw IRC lines to replay instead of generated ones",
+    )
+    parser.add_argument("--count", "-n", type=int, default=20000)
+    parser.add_argument("--repeat", "-r", type=int, default=5)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=25,
+        help="the change in percent beyond which a result is a regression",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as the new baseline"
+    )
+    args = parser.parse_args()
+
+    if args.input is not None:
+        with open(args.input, "r") as lines_file:
+            lines = [line.rstrip("\r\n") for line in lines_file]
+    else:
+        lines = generate_lines(args.count)
+
+    results = run(lines, args.repeat)
+
+    if args.save:
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=4)
+            baseline_file.write("\n")
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    return 0 if compare(results, baseline, args.tolerance) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Time-to-JOIN check of the bot.
+
+Starts the bot in a new process against a local fake Twitch server, and
+measures the time until it has joined all its channels. Fails if it takes
+longer than the budget.
+
+Run it from the repository root: python -m benchmarks.startup
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_twitch import FakeTwitchServer
+
+
+async def measure(nb_channels: int, timeout: float) -> (float, str):
+    """Return the time the bot took to join the channels, in seconds, and
+    the startup timings it has logged."""
+    server = FakeTwitchServer()
+    port = await server.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(
+                {
+                    "nickname": "startupbot",
+                    "channels": [{"channel": "chan%d" % i} for i in range(nb_channels)],
+                },
+                config_file,
+            )
+
+        started_at = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "twason",
+            "--config",
+            config_path,
+            "--server",
+            "127.0.0.1:%d" % port,
+            "--no-tls",
+            "--state-interval",
+            "0",
+            env={**os.environ, "TWITCH_TOKEN": "oauth:startup"},
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+        try:
+            while len(server.joined_at) < nb_channels:
+                if time.perf_counter() - started_at > timeout:
+                    return float("inf"), ""
+                await asyncio.sleep(0.001)
+            joined_at = max(server.joined_at.values())
+
+            # Let the bot receive the acknowledgements and log its timings
+            timings = ""
+            while not timings:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout)
+                if not line:
+                    break
+                if b"In the chat" in line:
+                    timings = line.decode().strip()
+        finally:
+            process.kill()
+            await process.wait()
+            await server.stop()
+
+    return joined_at - started_at, timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", "-c", type=int, default=10)
+    parser.add_argument("--repeat", "-r", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1000,
+        help="the time-to-JOIN in milliseconds beyond which it is a regression",
+    )
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(measure(args.channels, args.budget / 1000 * 10))
+        for _ in range(args.repeat)
+    ]
+    # Keep the fastest run, the slower ones being disturbed by the system
+    duration, timings = min(results)
+    print(timings)
+
+    regression = duration * 1000 > args.budget
+    print(
+        "%-28s %12.2f  (budget: %.2f)%s"
+        % (
+            "time_to_join_ms",
+            duration * 1000,
+            args.budget,
+            "  REGRESSION" if regression else "",
+        )
+    )
+    return 1 if regression else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Benchmark of the IRCv3 tags parser against tags sent by Twitch.
+
+Run it from the repository root: python -m benchmarks.tags
+"""
+
+import timeit
+
+from twason.utils import parse_tags
+
+# Tags of real Twitch messages, as documented on https://dev.twitch.tv/docs/irc/tags
+TAGS = {
+    "PRIVMSG": (
+        "badge-info=subscriber/8;badges=subscriber/6,premium/1;"
+        "client-nonce=d7a543c7dc514886b439d55826eeeb5b;color=#FF4500;"
+        "display-name=Lovingt3s;emotes=;first-msg=0;flags=;"
+        "id=b34ccfc7-4977-403a-8a94-33c6bac34fb8;mod=0;returning-chatter=0;"
+        "room-id=713936733;subscriber=1;tmi-sent-ts=1642696567751;turbo=0;"
+        "user-id=713936733;user-type="
+    ),
+    "PRIVMSG (emotes)": (
+        "badge-info=;badges=turbo/1;color=#0D4200;display-name=ronni;"
+        "emote-only=1;emotes=25:0-4,12-16/1902:6-10;first-msg=0;flags=;"
+        "id=b34ccfc7-4977-403a-8a94-33c6bac34fb8;mod=0;returning-chatter=0;"
+        "room-id=1337;subscriber=0;tmi-sent-ts=1507246572675;turbo=1;"
+        "user-id=1337;user-type=global_mod"
+    ),
+    "USERNOTICE (raid)": (
+        "badge-info=;badges=turbo/1;color=#9ACD32;display-name=TestChannel;"
+        "emotes=;flags=;id=3d830f12-795c-447d-af3c-ea05e40fbddb;"
+        "login=testchannel;mod=0;msg-id=raid;msg-param-displayName=TestChannel;"
+        "msg-param-login=testchannel;"
+        "msg-param-profileImageURL=https://static-cdn.jtvnw.net/jtv_user_pictures/"
+        "testchannel-profile_image-8a8c5be2e3b64a9a-300x300.png;"
+        "msg-param-viewerCount=15;room-id=33332222;subscriber=0;"
+        "system-msg=15\\sraiders\\sfrom\\sTestChannel\\shave\\sjoined\\n!;"
+        "tmi-sent-ts=1507246572675;turbo=1;user-id=123456;user-type="
+    ),
+}
+
+# The tags the bot actually reads when handling a message
+READ_TAGS = ["mod", "id", "emote-only", "emotes"]
+
+
+def parse_tags_eagerly(tags_str: str) -> {str: str}:
+    """The previous implementation, which splits the whole string into a dict."""
+    tags_list = []
+    for tag in tags_str.split(";"):
+        tags_list.append((tag.split("=")))
+
+    return dict(tags_list)
+
+
+def read(parser, tags_str: str):
+    tags = parser(tags_str)
+    return [tags.get(tag) for tag in READ_TAGS]
+
+
+def main():
+    number = 100000
+
+    for name, tags_str in TAGS.items():
+        durations = []
+        for parser in [parse_tags_eagerly, parse_tags]:
+            durations.append(
+                min(
+                    timeit.repeat(
+                        lambda: read(parser, tags_str), number=number, repeat=5
+                    )
+                )
+                / number
+                * 1e6
+            )
+
+        print(
+            "%-18s eager: %6.3f µs  lazy: %6.3f µs  (x%.1f)"
+            % (name, durations[0], durations[1], durations[0] / durations[1])
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from twason.cooldown import CommandCooldowns
+
+
+class CommandCooldownsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cooldowns = CommandCooldowns()
+        self.cooldowns.cooldowns.clock = lambda: self.now
+
+    def test_equal_global_and_user_cooldowns(self):
+        # Both cooldowns expire at the same time, the command name and the
+        # (name, author) pair having to share the heap
+        self.assertTrue(self.cooldowns.hit("discord", "alice", 30, 30))
+        self.assertFalse(self.cooldowns.hit("discord", "bob", 30, 30))
+        self.assertTrue(self.cooldowns.hit("twitter", "alice", 30, 30))
+
+        self.now += 30
+        self.assertTrue(self.cooldowns.hit("discord", "alice", 30, 30))
+        self.assertTrue(self.cooldowns.hit("twitter", "bob", 30, 30))
+
+    def test_user_cooldown(self):
+        self.assertTrue(self.cooldowns.hit("discord", "alice", 0, 60))
+        self.assertTrue(self.cooldowns.hit("discord", "bob", 0, 60))
+        self.assertFalse(self.cooldowns.hit("discord", "alice", 0, 60))
+
+        self.now += 60
+        self.assertTrue(self.cooldowns.hit("discord", "alice", 0, 60))
+
+
+if __name__ == "__main__":
+    unittest.main()
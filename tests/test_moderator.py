@@ -0,0 +1,108 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+import unittest
+
+from twason.moderator import (
+    AdaptivePolicy,
+    BannedWordsModerator,
+    FloodModerator,
+    ModerationDecision,
+    ModerationPipeline,
+)
+
+
+class BannedWordsTest(unittest.TestCase):
+    def vote(self, words, msg):
+        moderator = BannedWordsModerator(
+            "No bad words", ModerationDecision.DELETE_MSG, None, words, False, []
+        )
+        return moderator.vote(msg, "author")
+
+    def test_banned_words(self):
+        self.assertEqual(
+            ModerationDecision.DELETE_MSG, self.vote(["bad"], "That's BAD!")
+        )
+        self.assertEqual(ModerationDecision.DELETE_MSG, self.vote(["bad"], "b4d"))
+        self.assertEqual(ModerationDecision.ABSTAIN, self.vote(["bad"], "badge"))
+
+    def test_repeated_letters(self):
+        self.assertEqual(ModerationDecision.DELETE_MSG, self.vote(["bad"], "baaaad"))
+        self.assertEqual(
+            ModerationDecision.DELETE_MSG, self.vote(["butt"], "buuuttttt")
+        )
+
+    def test_shorter_runs(self):
+        self.assertEqual(
+            ModerationDecision.ABSTAIN, self.vote(["butt"], "but I like it")
+        )
+        self.assertEqual(
+            ModerationDecision.ABSTAIN, self.vote(["ass"], "as long as you want")
+        )
+
+    def test_pathological_message(self):
+        started_at = time.perf_counter()
+        self.assertEqual(
+            ModerationDecision.ABSTAIN, self.vote(["aaaa", "aab"], "a" * 400 + "z")
+        )
+        self.assertLess(time.perf_counter() - started_at, 0.1)
+
+
+class RaidTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.flood = FloodModerator(
+            "No flood", ModerationDecision.TIMEOUT_USER, 60, None, 5, False, 2, 30
+        )
+        self.flood.clock = lambda: self.now
+
+    def make_pipeline(self, adaptive):
+        pipeline = ModerationPipeline([self.flood], None, adaptive=adaptive)
+        pipeline.clock = lambda: self.now
+        return pipeline
+
+    def moderate(self, pipeline, msg):
+        decisions = []
+        pipeline.moderate(msg, "raider", lambda mod, vote: decisions.append(vote))
+        return decisions
+
+    def test_disabled_without_adaptive_mode(self):
+        pipeline = self.make_pipeline(None)
+        self.assertFalse(pipeline.declare_raid())
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+
+        self.now += 5 * 60
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+        self.assertEqual(
+            [ModerationDecision.TIMEOUT_USER], self.moderate(pipeline, "Raid!")
+        )
+
+    def test_relaxed_in_adaptive_mode(self):
+        pipeline = self.make_pipeline(AdaptivePolicy())
+        self.assertTrue(pipeline.declare_raid())
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+        self.assertEqual([], self.moderate(pipeline, "Raid!"))
+        self.assertEqual(
+            [ModerationDecision.TIMEOUT_USER], self.moderate(pipeline, "Raid!")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
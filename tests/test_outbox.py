@@ -0,0 +1,84 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from twason.outbox import Outbox, Priority
+
+
+class FakeLoop:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        return FakeHandle()
+
+
+class FakeHandle:
+    def cancel(self):
+        pass
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.sent = []
+        self.outbox = Outbox(
+            lambda target, message: self.sent.append(message), self.loop, rate=1
+        )
+
+    def flush(self, seconds):
+        self.loop.now += seconds
+        self.outbox._flush_handle = None
+        self.outbox.flush()
+
+    def test_batched_deletions(self):
+        self.outbox.delete("#chan", "spammer", "1")
+        self.outbox.delete("#chan", "spammer", "2")
+        self.outbox.delete("#chan", "spammer", "3")
+        self.flush(31)
+        self.assertEqual(["/delete 1", "/timeout spammer 1"], self.sent)
+
+    def test_deletions_after_timeout(self):
+        self.outbox.send("#chan", "Hello", Priority.TIMER)
+        self.outbox.timeout("#chan", "spammer", 600, "Spam")
+        self.outbox.delete("#chan", "spammer", "1")
+        self.outbox.delete("#chan", "spammer", "2")
+        self.flush(31)
+        self.flush(31)
+        self.assertEqual(["Hello", "/timeout spammer 600 Spam"], self.sent)
+
+    def test_timeout_cancels_pending_deletions(self):
+        self.outbox.send("#chan", "Hello", Priority.TIMER)
+        self.outbox.delete("#chan", "spammer", "1")
+        self.outbox.delete("#chan", "spammer", "2")
+        self.outbox.timeout("#chan", "spammer", 600, "Spam")
+        self.flush(31)
+        self.flush(31)
+        self.assertEqual(["Hello", "/timeout spammer 600 Spam"], self.sent)
+
+        # They can talk again once the timeout is over
+        self.flush(600)
+        self.outbox.delete("#chan", "spammer", "3")
+        self.assertEqual("/delete 3", self.sent[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
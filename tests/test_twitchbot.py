@@ -0,0 +1,34 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from twason.twitchbot import share_rate_limit
+
+
+class ShareRateLimitTest(unittest.TestCase):
+    def test_share(self):
+        self.assertEqual((20, 30), share_rate_limit(20, 30, 1))
+        self.assertEqual((6, 30), share_rate_limit(20, 30, 3))
+        self.assertEqual((1, 30), share_rate_limit(20, 30, 20))
+
+    def test_more_workers_than_lines(self):
+        self.assertEqual((1, 60), share_rate_limit(20, 30, 40))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,33 +17,74 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from time import perf_counter
+
+# Taken first, to measure the time spent importing the modules
+STARTED_AT = perf_counter()
+
 import argparse
-import irc3
+import os
 
-from . import twitchbot
-from .config import get_config
+from . import log
+from .startup import StartupTimer
 
-TWITCH_IRC_SERVER = "irc.chat.twitch.tv"
-TWITCH_IRC_PORT = 6697
+# The other modules are imported when needed, to start faster
 
 
 def main() -> int:
     args = get_arguments()
+    log.setup(args.log_level, args.log_format)
 
-    twitchbot.config = get_config(args.config)
-    bot = irc3.IrcBot.from_config(
-        {
-            "nick": twitchbot.config.nickname,
-            "password": twitchbot.config.token,
-            "autojoins": [],
-            "host": TWITCH_IRC_SERVER,
-            "port": TWITCH_IRC_PORT,
-            "ssl": True,
-            "includes": [twitchbot.__name__],
-        }
-    )
+    if args.command == "replay":
+        from . import replay
+
+        replay.run(args.config, args.log, args.processes, args.mmap)
+        log.stop()
+        exit(0)
+
+    state_file = args.state_file
+    if state_file is None:
+        state_file = os.path.join(os.path.dirname(args.config), "state.sqlite3")
 
+    server = None
+    if args.server is not None:
+        host, _, port = args.server.rpartition(":")
+        server = (host, int(port), not args.no_tls)
+
+    if args.workers > 1:
+        from . import supervisor
+
+        supervisor.run(
+            args.config,
+            args.workers,
+            args.log_level,
+            args.log_format,
+            args.reload_interval,
+            state_file,
+            args.state_interval,
+            server,
+        )
+        log.stop()
+        exit(0)
+
+    startup = StartupTimer(STARTED_AT)
+    from . import twitchbot
+    from .config import get_config
+
+    startup.step("imports")
+    config = get_config(args.config)
+    startup.step("configuration")
+    bot = twitchbot.create_bot(config, server)
+    plugin = bot.get_plugin(twitchbot.TwitchBot)
+    plugin.startup = startup
+    startup.step("setup")
+    if args.reload_interval > 0:
+        plugin.watch_config(args.reload_interval)
+    if args.state_interval > 0:
+        plugin.enable_state(state_file, args.state_interval)
     bot.run(forever=True)
+    plugin.close_state()
+    log.stop()
 
     exit(0)
 
@@ -51,6 +92,72 @@ def main() -> int:
 def get_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", "-c", type=str, default="config.json")
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="the number of processes the channels are spread over (defaults to 1)",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=0,
+        help="check every N seconds if the configuration file has been modified "
+        "and reload it (disabled by default, send SIGHUP to reload it manually)",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        default=None,
+        help="the SQLite database in which the state of the moderators and timers "
+        "is saved to survive restarts (defaults to state.sqlite3 next to the "
+        "configuration file)",
+    )
+    parser.add_argument(
+        "--state-interval",
+        type=float,
+        default=10,
+        help="save the state every N seconds (defaults to 10, 0 disables saving "
+        "and restoring the state)",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="the chat server to connect to, as host:port, instead of Twitch's "
+        "(to test the bot against a local server)",
+    )
+    parser.add_argument(
+        "--no-tls",
+        action="store_true",
+        help="connect to the chat server given with --server without TLS",
+    )
+    parser.add_argument("--log-level", choices=log.LEVELS, default="info")
+    parser.add_argument("--log-format", choices=log.FORMATS, default="text")
+
+    subparsers = parser.add_subparsers(dest="command")
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="run the moderators over chat logs, without connecting to the chat, "
+        "and print what they would have done",
+    )
+    replay_parser.add_argument(
+        "log", help="a file of raw IRC lines, with their tags, as sent by Twitch"
+    )
+    replay_parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="the number of processes the channels are spread over, "
+        "at most one per channel (defaults to the number of CPUs)",
+    )
+    replay_parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="map the log file in memory instead of reading it",
+    )
 
     return parser.parse_args()
 
@@ -0,0 +1,146 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import sys
+
+from collections import OrderedDict
+from typing import Union
+
+from .moderator import ModerationDecision
+
+# Twitch does not accept longer timeouts
+MAX_TIMEOUT_DURATION = 14 * 24 * 3600
+
+
+class Chatter:
+    __slots__ = (
+        "name",
+        "first_seen",
+        "last_seen",
+        "nb_messages",
+        "strikes",
+        "last_strike",
+    )
+
+    def __init__(self, name: str, now: float):
+        self.name = name
+        self.first_seen = now
+        self.last_seen = now
+        self.nb_messages = 0
+        self.strikes = 0
+        self.last_strike = None
+
+
+class ChatterRegistry:
+    """The chatters of a channel who have talked recently.
+
+    The chatters are kept in least-recently-seen order, so those who have not
+    talked for `ttl` seconds are forgotten from the front, as well as the
+    oldest ones when more than `max_chatters` are tracked. Their names are
+    interned, so the other structures keyed by chatter share the same string.
+    """
+
+    def __init__(self, max_chatters: int = 50000, ttl: float = 3600):
+        self.max_chatters = max_chatters
+        self.ttl = ttl
+        self.chatters = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.chatters)
+
+    def get(self, name: str) -> Union[None, Chatter]:
+        return self.chatters.get(name)
+
+    def see(self, name: str, now: float) -> Chatter:
+        """Return the chatter who has just sent a message, tracking them
+        if they were not yet."""
+        chatter = self.chatters.get(name)
+        if chatter is None:
+            name = sys.intern(name)
+            chatter = Chatter(name, now)
+            self.chatters[name] = chatter
+            self.expire(now)
+        else:
+            self.chatters.move_to_end(name)
+            chatter.last_seen = now
+
+        chatter.nb_messages += 1
+        return chatter
+
+    def expire(self, now: float):
+        chatters = self.chatters
+        while len(chatters) > self.max_chatters:
+            chatters.popitem(last=False)
+
+        expiry = now - self.ttl
+        while chatters and next(iter(chatters.values())).last_seen <= expiry:
+            chatters.popitem(last=False)
+
+    def resize(self, max_chatters: int, ttl: float, now: float):
+        self.max_chatters = max_chatters
+        self.ttl = ttl
+        self.expire(now)
+
+
+class StrikePolicy:
+    """Escalate the moderation of the chatters who keep misbehaving.
+
+    Every moderation action gives the chatter a strike, and the strikes are
+    forgotten `expiry` seconds after the last one. From `max_strikes` strikes,
+    the messages are not only deleted anymore: the chatter is timed out,
+    for a duration that doubles with each new strike.
+    """
+
+    def __init__(
+        self, max_strikes: int = 3, timeout_duration: int = 600, expiry: float = 3600
+    ):
+        self.max_strikes = max_strikes
+        self.timeout_duration = timeout_duration
+        self.expiry = expiry
+
+    @classmethod
+    def from_dict(cls, params: dict):
+        return StrikePolicy(
+            params.get("max", 3),
+            params.get("duration", 600),
+            params.get("expiry", 3600),
+        )
+
+    def strike(
+        self,
+        chatter: Chatter,
+        decision: ModerationDecision,
+        duration: Union[None, int],
+        now: float,
+    ) -> (ModerationDecision, Union[None, int]):
+        """Count the strike, and return the decision and timeout duration to apply."""
+        if chatter.last_strike is not None and now - chatter.last_strike > self.expiry:
+            chatter.strikes = 0
+        chatter.strikes += 1
+        chatter.last_strike = now
+
+        if chatter.strikes < self.max_strikes:
+            return decision, duration
+
+        escalated = min(
+            MAX_TIMEOUT_DURATION,
+            self.timeout_duration * 2 ** (chatter.strikes - self.max_strikes),
+        )
+        if decision == ModerationDecision.TIMEOUT_USER and (duration or 0) >= escalated:
+            return decision, duration
+
+        return ModerationDecision.TIMEOUT_USER, escalated
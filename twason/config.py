@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import hashlib
 import json
 
 from os import environ
@@ -22,21 +23,37 @@ from enum import Enum
 from typing import Union
 
 from . import moderator
+from . import schema
+from .chatters import StrikePolicy
+from .template import Template
+from .log import logger
 
 
 class Command:
     name: str
     message: str
+    template: Template
     aliases: [str]
     disabled: bool
+    cooldown: float
+    user_cooldown: float
 
     def __init__(
-        self, name: str, message: str, aliases: [str] = None, disabled: bool = False
+        self,
+        name: str,
+        message: str,
+        aliases: [str] = None,
+        disabled: bool = False,
+        cooldown: float = 0,
+        user_cooldown: float = 0,
     ):
         self.name = name
         self.message = message
+        self.template = Template(message)
         self.aliases = aliases if aliases is not None else []
         self.disabled = disabled
+        self.cooldown = cooldown
+        self.user_cooldown = user_cooldown
 
     @classmethod
     def from_dict(cls, params: dict):
@@ -45,6 +62,8 @@ class Command:
             params["message"],
             params.get("aliases", []),
             params.get("disabled", False),
+            params.get("cooldown", 0),
+            params.get("user-cooldown", 0),
         )
 
 
@@ -88,42 +107,63 @@ class Timer:
         )
 
 
-class Config:
+class ChannelConfig:
     channel: str
-    nickname: str
-    token: str
     command_prefix: str
     commands: [Command]
-    timer: Timer
+    commands_index: {str: Command}
+    timers: [Timer]
     moderators: [moderator.Moderator]
+    strikes: Union[None, StrikePolicy]
+    max_tracked_chatters: int
+    chatter_ttl: float
+    adaptive: Union[None, moderator.AdaptivePolicy]
+    params: Union[None, dict]
 
     def __init__(
         self,
         channel: str,
-        nickname: str,
-        token: str,
         command_prefix: str,
         commands: [Command],
-        timer: Timer,
+        timers: [Timer],
         moderators: [moderator.Moderator],
+        strikes: Union[None, StrikePolicy] = None,
+        max_tracked_chatters: int = 50000,
+        chatter_ttl: float = 3600,
+        adaptive: Union[None, moderator.AdaptivePolicy] = None,
     ):
-        self.nickname = nickname
         self.channel = channel
-        self.token = token
         self.command_prefix = command_prefix
-        self.commands = commands
-        self.timer = timer
+        self.commands = []
+        self.commands_index = {}
+        self.timers = timers
         self.moderators = moderators
+        self.strikes = strikes
+        self.max_tracked_chatters = max_tracked_chatters
+        self.chatter_ttl = chatter_ttl
+        self.adaptive = adaptive
+        # The options the configuration was built from, if any
+        self.params = None
+
+        for command in commands:
+            self.add_command(command)
 
     @classmethod
-    def from_dict(cls, params: dict, token: str):
-        timer = Timer.from_dict(params.get("timer", {}))
+    def from_dict(cls, params: dict):
+        timers_params = params.get("timers", [])
+        if "timer" in params:
+            timers_params = [params["timer"], *timers_params]
+
+        # Timers without messages would have nothing to send
+        timers = [
+            timer
+            for timer in map(Timer.from_dict, timers_params)
+            if len(timer.pool) > 0
+        ]
 
         commands_prefix = params.get("command_prefix", "!")
         commands = []
 
-        help_command = Command("help", "Voici les commandes disponibles : ")
-
         for command in params.get("commands", []):
             command = Command.from_dict(command)
 
@@ -132,11 +172,12 @@ class Config:
 
             commands.append(command)
 
-        for command in timer.pool:
-            if command.name is None:
-                continue
+        for timer in timers:
+            for command in timer.pool:
+                if command.name is None:
+                    continue
 
-            commands.append(command)
+                commands.append(command)
 
         moderators = []
         for mod in params.get("moderator", []):
@@ -164,57 +205,166 @@ class Config:
                         moderator_config.get("ignore-hashtags", False),
                         moderator_config.get("max-msg-occurrences", None),
                         moderator_config.get("min-time-between-occurrence", None),
+                        moderator_config.get("max-tracked-authors", 10000),
                     )
                 )
-
-        # Generate help command
-        if params.get("help", True):
-            for command in commands:
-                help_command.message = "%s %s%s" % (
-                    help_command.message,
-                    commands_prefix,
-                    command.name,
+            if mod == "banned-words":
+                moderators.append(
+                    moderator.BannedWordsModerator(
+                        moderator_config.get(
+                            "message", "{author}, watch your language!"
+                        ),
+                        cls.parse_decision(moderator_config.get("decision", "delete")),
+                        moderator_config.get("duration", None),
+                        moderator_config.get("words", []),
+                        moderator_config.get("links", False),
+                        moderator_config.get("allowed-links", []),
+                    )
                 )
 
-            commands.append(help_command)
-
-        return Config(
-            params.get("channel"),
-            params.get("nickname"),
-            token,
+        channel_config = ChannelConfig(
+            params["channel"].lstrip("#").lower(),
             commands_prefix,
             commands,
-            timer,
+            timers,
             moderators,
+            StrikePolicy.from_dict(params["strikes"]) if "strikes" in params else None,
+            params.get("max-tracked-chatters", 50000),
+            params.get("chatter-ttl", 3600),
+            # Enabled unless explicitly disabled with null
+            (
+                moderator.AdaptivePolicy.from_dict(params.get("adaptive", {}))
+                if params.get("adaptive", {}) is not None
+                else None
+            ),
         )
 
+        # Generate help command, listing the commands which could be indexed
+        if params.get("help", True) and "help" not in channel_config.commands_index:
+            help_message = "Voici les commandes disponibles : %s" % " ".join(
+                commands_prefix + command.name for command in channel_config.commands
+            )
+            channel_config.add_command(Command("help", help_message))
+
+        channel_config.params = params
+        return channel_config
+
+    def renew(self) -> "ChannelConfig":
+        """Build the configuration of the channel again from its options,
+        with moderators that have not been used yet."""
+        if self.params is None:
+            return self
+
+        return ChannelConfig.from_dict(self.params)
+
     @classmethod
     def parse_decision(cls, decision_str) -> moderator.ModerationDecision:
-        if decision_str == "delete":
-            decision = moderator.ModerationDecision.DELETE_MSG
-        elif decision_str == "timeout":
-            decision = moderator.ModerationDecision.TIMEOUT_USER
-        else:
-            print(
-                "WARNING: %s moderator's decision is invalid, it has been deactivated!"
-            )
-            decision = moderator.ModerationDecision.ABSTAIN
-        return decision
+        # The schema only accepts these two decisions
+        if decision_str == "timeout":
+            return moderator.ModerationDecision.TIMEOUT_USER
+        return moderator.ModerationDecision.DELETE_MSG
+
+    def add_command(self, command: Command):
+        if command.disabled:
+            return
+
+        for name in [command.name, *command.aliases]:
+            if name is None:
+                continue
+
+            existing = self.commands_index.get(name)
+            if existing is not None and existing is not command:
+                logger.warning(
+                    "%s%s is already used by %s%s, it has been ignored!",
+                    self.command_prefix,
+                    name,
+                    self.command_prefix,
+                    existing.name,
+                )
+                if name == command.name:
+                    # The command could not be called by its name
+                    return
+                continue
+
+            self.commands_index[name] = command
+
+        self.commands.append(command)
 
     def find_command(self, command: str) -> Union[None, Command]:
         if not command.startswith(self.command_prefix):
             return None
 
-        command = command[1:]
+        return self.commands_index.get(command[len(self.command_prefix) :])
 
-        for c in self.commands:
-            if c.name == command or command in c.aliases:
-                return c
 
-        return None
+class Config:
+    nickname: str
+    token: str
+    channels: {str: ChannelConfig}
+    bot_is_moderator: bool
+    metrics: Union[None, dict]
+    moderation_threads: int
+    path: Union[None, str]
+    digest: Union[None, str]
 
+    def __init__(
+        self,
+        nickname: str,
+        token: str,
+        channels: [ChannelConfig],
+        bot_is_moderator: bool = False,
+        metrics: Union[None, dict] = None,
+        moderation_threads: int = 0,
+    ):
+        self.nickname = nickname
+        self.token = token
+        self.channels = {channel.channel: channel for channel in channels}
+        self.bot_is_moderator = bot_is_moderator
+        self.metrics = metrics
+        self.moderation_threads = moderation_threads
+        self.path = None
+        self.digest = None
+
+    @classmethod
+    def from_dict(cls, params: dict, token: str):
+        schema.validate(params)
+
+        channels_params = params.get("channels")
+
+        if channels_params is None:
+            channels = [ChannelConfig.from_dict(params)]
+        else:
+            # The options set at the root of the configuration are shared by
+            # all the channels, which can override them
+            shared_params = {
+                key: value for key, value in params.items() if key != "channels"
+            }
+            channels = [
+                ChannelConfig.from_dict({**shared_params, **channel_params})
+                for channel_params in channels_params
+            ]
+
+        return Config(
+            params.get("nickname"),
+            token,
+            channels,
+            params.get("bot_is_moderator", False),
+            params.get("metrics"),
+            params.get("moderation_threads", 0),
+        )
+
+
+def get_config(file_path: str, known_digest: str = None) -> Union[None, Config]:
+    """Load the configuration file, or return None if its content still has
+    the `known_digest` hash, as nothing would change."""
+    with open(file_path, "rb") as config_file:
+        content = config_file.read()
+
+    digest = hashlib.sha256(content).hexdigest()
+    if digest == known_digest:
+        return None
 
-def get_config(file_path: str):
-    with open(file_path, "r") as config_file:
-        token = environ["TWITCH_TOKEN"]
-        return Config.from_dict(json.loads(config_file.read()), token)
+    config = Config.from_dict(json.loads(content), environ["TWITCH_TOKEN"])
+    config.path = file_path
+    config.digest = digest
+    return config
@@ -0,0 +1,100 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import irc3
+import random
+
+from .log import logger
+
+# The delay before reconnecting doubles after each failure, up to the maximum
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 120
+
+
+class TwitchConnection(irc3.IrcConnection):
+    def connection_lost(self, exc):
+        # The connections closed on purpose are not lost
+        if self.closed:
+            return
+
+        self.close()
+        if self is self.factory.previous_protocol:
+            # The connection being replaced has been closed by the server
+            self.factory.previous_protocol = None
+            return
+
+        self.factory.notify("connection_lost")
+        self.factory.reconnect()
+
+
+class TwitchIrcBot(irc3.IrcBot):
+    """irc3's bot, reconnecting with an exponential backoff, and able to open
+    a new connection before closing the current one."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed_connections = 0
+        # The connection kept open while the new one is being set up
+        self.previous_protocol = None
+        self._replacing = False
+
+    def reconnect(self):
+        delay = min(
+            RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2**self.failed_connections
+        )
+        # Jitter, so the workers don't all reconnect at the same time
+        delay = random.uniform(delay / 2, delay)
+        self.failed_connections += 1
+
+        logger.info("Reconnecting in %.1f seconds", delay)
+        self.loop.call_later(delay, self.create_connection)
+
+    def replace_connection(self):
+        """Open a new connection, keeping the current one until
+        close_previous_connection() is called."""
+        self._replacing = True
+        # Known before connecting, as the server may close the current
+        # connection before the new one is made
+        self.previous_protocol = getattr(self, "protocol", None)
+        self.create_connection()
+
+    def close_previous_connection(self):
+        if self.previous_protocol is not None:
+            self.previous_protocol.close()
+            self.previous_protocol = None
+
+    def connection_made(self, f):
+        if f.cancelled() or f.exception() is not None:
+            logger.error(
+                "Could not connect to the chat: %s",
+                "cancelled" if f.cancelled() else f.exception(),
+            )
+            self._replacing = False
+            self.reconnect()
+            return
+
+        if self._replacing:
+            # Keep irc3 from closing the current connection
+            self._replacing = False
+            self.protocol = None
+
+        super().connection_made(f)
+
+    def connection_ready(self):
+        """Call once the new session has joined the channels."""
+        self.failed_connections = 0
+        self.close_previous_connection()
@@ -0,0 +1,99 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import heapq
+import itertools
+import time
+
+from typing import Hashable
+
+
+class Cooldowns:
+    """Remember which keys are cooling down, and until when.
+
+    The expiries are kept in a heap next to a dictionary, so the expired keys
+    are dropped in order each time a key is checked, and the structure never
+    holds more than `max_entries` keys: when it is full, the keys that are
+    the closest to the end of their cooldown are released first.
+    """
+
+    clock = time.monotonic
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.expiries = {}
+        # (expiry, order, key) entries: the order breaks the ties between equal
+        # expiries, so the keys, which are not comparable, are never compared
+        self.heap = []
+        self.order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.expiries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        expiry = self.expiries.get(key)
+        return expiry is not None and expiry > self.clock()
+
+    def start(self, key: Hashable, duration: float):
+        if duration <= 0:
+            return
+
+        now = self.clock()
+        self._expire(now)
+        while len(self.expiries) >= self.max_entries:
+            self._pop()
+
+        expiry = now + duration
+        self.expiries[key] = expiry
+        heapq.heappush(self.heap, (expiry, next(self.order), key))
+
+    def _pop(self):
+        expiry, _, key = heapq.heappop(self.heap)
+        # The key may have been started again since this entry was pushed
+        if self.expiries.get(key) == expiry:
+            del self.expiries[key]
+
+    def _expire(self, now: float):
+        while self.heap and self.heap[0][0] <= now:
+            self._pop()
+
+
+class CommandCooldowns:
+    """The cooldowns of the commands of a channel.
+
+    A command can have a global cooldown, during which nobody can invoke it,
+    and a per-user cooldown, during which the user who invoked it cannot
+    invoke it again.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.cooldowns = Cooldowns(max_entries)
+        self.answered = {}
+        self.suppressed = {}
+
+    def hit(self, name: str, author: str, cooldown: float, user_cooldown: float):
+        """Return True if the command can be answered, and start its cooldowns."""
+        if (cooldown and name in self.cooldowns) or (
+            user_cooldown and (name, author) in self.cooldowns
+        ):
+            self.suppressed[name] = self.suppressed.get(name, 0) + 1
+            return False
+
+        self.cooldowns.start(name, cooldown)
+        self.cooldowns.start((name, author), user_cooldown)
+        self.answered[name] = self.answered.get(name, 0) + 1
+        return True
@@ -0,0 +1,108 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import sys
+
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+logger = logging.getLogger("twason")
+
+LEVELS = ["debug", "info", "warning", "error"]
+FORMATS = ["text", "json"]
+
+_listener = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Leave the formatting to the listener thread. This is only safe
+        # because the bot logs immutable values.
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """Write the messages after the prefix, and after their level from the
+    warnings on."""
+
+    def __init__(self, prefix: str = ""):
+        super().__init__()
+        self.prefix = prefix
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return "%s%s: %s" % (self.prefix, record.levelname, message)
+
+        return self.prefix + message
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, fields: {str: object} = None):
+        super().__init__()
+        self.fields = fields if fields is not None else {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(
+            {
+                "time": record.created,
+                "level": record.levelname.lower(),
+                **self.fields,
+                "message": record.getMessage(),
+            },
+            ensure_ascii=False,
+        )
+
+
+def setup(level: str = "info", log_format: str = "text", prefix: str = "", **fields):
+    """Write the logs of the bot from a background thread.
+
+    Logging a message only puts the record in a queue: it is formatted and
+    written to the standard output by the thread. Messages below the level
+    are dropped before being formatted.
+    The fields are added to every JSON log, and the prefix to every text log.
+    """
+    global _listener
+
+    if log_format == "json":
+        formatter = JsonFormatter(fields)
+    else:
+        formatter = TextFormatter(prefix)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(formatter)
+
+    queue = SimpleQueue()
+    logger.handlers = [DeferredQueueHandler(queue)]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = QueueListener(queue, handler)
+    _listener.start()
+
+
+def stop():
+    """Write the remaining logs and stop the background thread."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
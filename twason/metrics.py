@@ -0,0 +1,232 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable
+
+from .log import logger
+
+# Set to True when the metrics endpoint is started.
+# The bot only measures anything when it is.
+enabled = False
+# The server of the metrics endpoint, once it listens
+server = None
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+
+def _format_labels(names: (str,), values: (str,), extra: str = "") -> str:
+    labels = ['%s="%s"' % (name, value) for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+
+    return "{%s}" % ",".join(labels) if labels else ""
+
+
+class Metric(ABC):
+    type = None
+
+    def __init__(self, name: str, description: str, labels: (str,) = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def render_samples(self) -> [str]:
+        pass
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                "# HELP %s %s" % (self.name, self.description),
+                "# TYPE %s %s" % (self.name, self.type),
+                *self.render_samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: (str,) = ()):
+        super().__init__(name, description, labels)
+        self.values = {} if labels else {(): 0}
+
+    def inc(self, *label_values: str, value: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def render_samples(self) -> [str]:
+        return [
+            "%s%s %s" % (self.name, _format_labels(self.labels, values), value)
+            for values, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """A value read when the metrics are rendered."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.functions = []
+
+    def read_from(self, function: Callable[[], float]):
+        self.functions.append(function)
+
+    def render_samples(self) -> [str]:
+        return ["%s %s" % (self.name, sum(f() for f in self.functions))]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: (str,) = (),
+        buckets: (float,) = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value: float, *label_values: str):
+        values = self.values.get(label_values)
+        if values is None:
+            # One counter per bucket, then the +Inf one and the sum
+            values = [0] * (len(self.buckets) + 2)
+            self.values[label_values] = values
+
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render_samples(self) -> [str]:
+        samples = []
+        for label_values, values in self.values.items():
+            total = 0
+            for bucket, count in zip((*self.buckets, "+Inf"), values):
+                total += count
+                samples.append(
+                    "%s_bucket%s %d"
+                    % (
+                        self.name,
+                        _format_labels(self.labels, label_values, 'le="%s"' % bucket),
+                        total,
+                    )
+                )
+
+            labels = _format_labels(self.labels, label_values)
+            samples.append("%s_sum%s %s" % (self.name, labels, values[-1]))
+            samples.append("%s_count%s %d" % (self.name, labels, total))
+
+        return samples
+
+
+REGISTRY = []
+
+LINES_RECEIVED = Counter(
+    "twason_lines_received_total", "Lines received, by event type.", ("event",)
+)
+ON_MSG_DURATION = Histogram(
+    "twason_on_msg_duration_seconds", "Time spent handling a chat message."
+)
+VOTE_DURATION = Histogram(
+    "twason_moderator_vote_duration_seconds",
+    "Time spent by a moderator to vote on a message.",
+    ("moderator",),
+)
+DECISIONS = Counter(
+    "twason_moderator_decisions_total",
+    "Decisions taken by the moderators.",
+    ("moderator", "decision"),
+)
+OUTBOX_DEPTH = Gauge(
+    "twason_outbox_depth", "Messages waiting to be sent because of the rate limit."
+)
+FLOOD_HISTORY_SIZE = Gauge(
+    "twason_flood_history_messages",
+    "Messages remembered by the flood moderators to detect the repetitions.",
+)
+ADAPTIVE_CHANNELS = Gauge(
+    "twason_adaptive_channels",
+    "Channels whose moderators are in adaptive mode because of a burst.",
+)
+COMMANDS = Counter(
+    "twason_commands_total",
+    "Commands invoked in the chat, answered or suppressed by their cooldown.",
+    ("command", "outcome"),
+)
+RECONNECTIONS = Counter(
+    "twason_connections_lost_total", "Times the connection to the chat was lost."
+)
+DOWNTIME = Counter(
+    "twason_downtime_seconds_total",
+    "Time spent without being able to send messages in the chat.",
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    request = await reader.readline()
+    # Skip the headers
+    while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+        pass
+
+    if request.split(b" ")[1:2] == [b"/metrics"]:
+        status, body = "200 OK", render()
+    else:
+        status, body = "404 Not Found", "Not Found\n"
+
+    body = body.encode()
+    writer.write(
+        (
+            "HTTP/1.1 %s\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            "Content-Length: %d\r\n"
+            "Connection: close\r\n\r\n" % (status, len(body))
+        ).encode()
+        + body
+    )
+    await writer.drain()
+    writer.close()
+
+
+def start(loop: asyncio.AbstractEventLoop, host: str, port: int):
+    global enabled
+    enabled = True
+
+    task = loop.create_task(asyncio.start_server(_handle_request, host, port))
+    task.add_done_callback(lambda task: _on_started(task, host, port))
+
+
+def _on_started(task: asyncio.Task, host: str, port: int):
+    global enabled, server
+    try:
+        server = task.result()
+    except OSError as e:
+        # Nothing would serve what the bot measures
+        enabled = False
+        logger.error("Could not serve the metrics on %s:%d: %s", host, port, e)
@@ -15,12 +15,30 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import asyncio
+import math
+import re
+import time
+import unicodedata
+import zlib
+
 from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
 from enum import Enum
-from typing import Union
-from datetime import datetime, timedelta
+from functools import lru_cache
+from time import perf_counter
+from typing import Callable, Union
+
+from . import metrics
+from .log import logger
+from .template import Template, MODERATOR_VARIABLES
 
-EPOCH = datetime(1970, 1, 1)
+# The duration of the timeouts when none is set, as Twitch does
+DEFAULT_TIMEOUT_DURATION = 600
+# The minimum time the moderators stay in adaptive mode, so they don't switch
+# back and forth when the chat rate hovers around the threshold
+ADAPTIVE_MIN_DURATION = 30
 
 
 class ModerationDecision(Enum):
@@ -31,8 +49,16 @@ class ModerationDecision(Enum):
 
 class Moderator(ABC):
     message: str
+    template: Template
     decision: ModerationDecision
 
+    # How expensive the vote is: the cheapest moderators vote first
+    cost = 0
+    # Whether the vote can run in a thread, away from the event loop
+    offload = False
+    # Whether the vote can be skipped for some messages in adaptive mode
+    sampled = False
+
     def __init__(
         self,
         message: str,
@@ -40,19 +66,42 @@ class Moderator(ABC):
         timeout_duration: Union[None, int],
     ):
         self.message = message
-        self.timeout_duration = timeout_duration
+        self.template = Template(message, MODERATOR_VARIABLES)
+        self.timeout_duration = (
+            timeout_duration
+            if timeout_duration is not None
+            else DEFAULT_TIMEOUT_DURATION
+        )
         self.decision = decision
 
     @abstractmethod
     def get_name(self) -> str:
         pass
 
+    def record(self, msg: str, author: str):
+        """Update the state of the moderator with a message, whatever the
+        decision taken about it. Called on the event loop before the votes,
+        which must not modify the state themselves."""
+        pass
+
     @abstractmethod
     def vote(self, msg: str, author: str) -> ModerationDecision:
         pass
 
+    def inherit_state(self, previous: "Moderator"):
+        """Take the live state over from the moderator this one replaces
+        when the configuration is reloaded."""
+        pass
+
+    def adapt(self, adaptive: bool):
+        """Relax the thresholds of the moderator while the chat is too busy
+        for them to make sense, or restore them."""
+        pass
+
 
 class CapsLockModerator(Moderator):
+    cost = 1
+
     def __init__(
         self,
         message: str,
@@ -64,31 +113,142 @@ class CapsLockModerator(Moderator):
         super().__init__(message, decision, timeout_duration)
 
         self.min_size = min_size
-        self.threshold = threshold / 100
+        self.base_threshold = threshold / 100
+        self.threshold = self.base_threshold
 
     def get_name(self) -> str:
         return "Caps Lock"
 
+    def adapt(self, adaptive: bool):
+        # Halfway to a message written only in capital letters
+        self.threshold = (
+            (1 + self.base_threshold) / 2 if adaptive else self.base_threshold
+        )
+
     def vote(self, msg: str, author: str) -> ModerationDecision:
-        msg = "".join(filter(str.isalpha, msg))
+        # The message can't contain more letters than characters
+        if not msg or len(msg) < self.min_size:
+            return ModerationDecision.ABSTAIN
+
+        lowercase = sum(map(str.islower, msg))
 
-        if len(msg) < self.min_size:
+        # Too many lowercase letters to reach the threshold,
+        # even if every other character of the message is a capital letter
+        if (len(msg) - lowercase) / len(msg) < self.threshold:
             return ModerationDecision.ABSTAIN
 
-        n = 0
-        for char in msg:
-            if char.strip() == "":
-                continue
-            if char == char.upper():
-                n += 1
+        letters = sum(map(str.isalpha, msg))
+        if not letters or letters < self.min_size:
+            return ModerationDecision.ABSTAIN
 
-        if n / len(msg) >= self.threshold:
+        if (letters - lowercase) / letters >= self.threshold:
             return self.decision
 
         return ModerationDecision.ABSTAIN
 
 
+class AuthorHistory:
+    __slots__ = ("messages", "occurrences")
+
+    def __init__(self):
+        # (timestamp, message key) pairs, oldest first
+        self.messages = deque()
+        self.occurrences = {}
+
+
+class MessageHistory:
+    """The messages recently sent by each author, within a sliding time window.
+
+    Authors are kept in least-recently-active order so the memory can be
+    capped by forgetting the authors that have not talked for the longest time.
+    """
+
+    def __init__(self, window: float, max_authors: int):
+        self.window = window
+        self.max_authors = max_authors
+        self.authors = OrderedDict()
+        self.size = 0
+        # When set to a list, the (author, timestamp, message key) of every
+        # message added, so they can be saved
+        self.journal = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def _key(msg: str) -> int:
+        # Unlike hash(), stays the same when the bot restarts
+        return zlib.crc32(" ".join(msg.casefold().split()).encode())
+
+    def add(self, author: str, msg: str, now: float) -> int:
+        """Record the message and return how many times the author sent it
+        in the time window, including this one."""
+        return self.add_key(author, self._key(msg), now)
+
+    def add_key(self, author: str, key: int, now: float) -> int:
+        history = self.authors.get(author)
+        if history is None:
+            history = AuthorHistory()
+            self.authors[author] = history
+            if len(self.authors) > self.max_authors:
+                self.forget(next(iter(self.authors)))
+        else:
+            self.authors.move_to_end(author)
+            self._expire(history, now)
+
+        # Opportunistically drop the least recently active author
+        # if all their messages have expired
+        oldest_author = next(iter(self.authors))
+        if oldest_author != author:
+            oldest = self.authors[oldest_author]
+            if oldest.messages[-1][0] <= now - self.window:
+                self.forget(oldest_author)
+
+        history.messages.append((now, key))
+        occurrences = history.occurrences.get(key, 0) + 1
+        history.occurrences[key] = occurrences
+        self.size += 1
+        if self.journal is not None:
+            self.journal.append((author, now, key))
+
+        return occurrences
+
+    def count(self, author: str, msg: str) -> int:
+        """Return how many times the author sent the message in the time window."""
+        history = self.authors.get(author)
+        if history is None:
+            return 0
+
+        return history.occurrences.get(self._key(msg), 0)
+
+    def resize(self, window: float, max_authors: int):
+        self.window = window
+        self.max_authors = max_authors
+        while len(self.authors) > max_authors:
+            self.forget(next(iter(self.authors)))
+
+    def forget(self, author: str):
+        history = self.authors.pop(author, None)
+        if history is not None:
+            self.size -= len(history.messages)
+
+    def _expire(self, history: AuthorHistory, now: float):
+        expiry = now - self.window
+        messages = history.messages
+        occurrences = history.occurrences
+
+        while messages and messages[0][0] <= expiry:
+            _, key = messages.popleft()
+            self.size -= 1
+            if occurrences[key] == 1:
+                del occurrences[key]
+            else:
+                occurrences[key] -= 1
+
+
 class FloodModerator(Moderator):
+    cost = 2
+
     def __init__(
         self,
         message: str,
@@ -99,24 +259,38 @@ class FloodModerator(Moderator):
         ignore_hashtags: bool,
         max_msg_occurrences: Union[None, int],
         min_time_between_occurrence: Union[None, int],
+        max_tracked_authors: int = 10000,
     ):
         super().__init__(message, decision, timeout_duration)
+        self.clock = time.monotonic
         self.max_word_length = max_word_length
         self.raid_cooldown = raid_cooldown
-        self.last_raid = EPOCH
+        self.last_raid = None
+        # Without adaptive mode, the moderator stays disabled during raids
+        self.disabled_on_raid = True
         self.ignore_hashtags = ignore_hashtags
+        self.base_max_msg_occurrences = max_msg_occurrences
         self.max_msg_occurrences = max_msg_occurrences
         self.min_time_between_occurrence = min_time_between_occurrence
-        self.last_msgs = []
+        self.max_tracked_authors = max_tracked_authors
+        self.last_msgs = MessageHistory(
+            min_time_between_occurrence or 0, max_tracked_authors
+        )
+        # The author, message and number of occurrences of the last recorded message
+        self.last_recorded = (None, None, 0)
 
     def get_name(self) -> str:
         return "Flood"
 
+    def record(self, msg: str, author: str):
+        if self.max_msg_occurrences is None or self.min_time_between_occurrence is None:
+            return
+
+        occurrences = self.last_msgs.add(author, msg, self.clock())
+        self.last_recorded = (author, msg, occurrences)
+
     def vote(self, msg: str, author: str) -> ModerationDecision:
-        if (
-            self.raid_cooldown is not None
-            and self.last_raid + timedelta(minutes=self.raid_cooldown) > datetime.now()
-        ):
+        if self.disabled_on_raid and self.is_raided():
             return ModerationDecision.ABSTAIN
 
         if self.max_word_length is not None:
@@ -129,36 +303,441 @@ class FloodModerator(Moderator):
         if self.max_msg_occurrences is None or self.min_time_between_occurrence is None:
             return ModerationDecision.ABSTAIN
 
-        clean_msg = None
-        for last_msg in self.last_msgs:
-            if (
-                last_msg["first-occurrence"]
-                + timedelta(seconds=self.min_time_between_occurrence)
-                <= datetime.now()
-            ):
-                clean_msg = last_msg
-                break
+        last_author, last_msg, occurrences = self.last_recorded
+        if last_msg is not msg or last_author != author:
+            occurrences = self.last_msgs.count(author, msg)
 
-            if author != last_msg["author"] or msg != last_msg["message"]:
-                break
+        if occurrences >= self.max_msg_occurrences:
+            return ModerationDecision.TIMEOUT_USER
+
+        return ModerationDecision.ABSTAIN
+
+    def inherit_state(self, previous: Moderator):
+        self.last_raid = previous.last_raid
+        self.last_msgs = previous.last_msgs
+        self.last_msgs.resize(
+            self.min_time_between_occurrence or 0, self.max_tracked_authors
+        )
+
+    def adapt(self, adaptive: bool):
+        # The chat repeats the same messages during raids and hype moments
+        self.max_msg_occurrences = (
+            self.base_max_msg_occurrences * 2
+            if adaptive and self.base_max_msg_occurrences is not None
+            else self.base_max_msg_occurrences
+        )
+
+    def declare_raid(self):
+        self.last_raid = self.clock()
+
+    def is_raided(self) -> bool:
+        """Return whether the cooldown of the last raid is still running."""
+        return (
+            self.raid_cooldown is not None
+            and self.last_raid is not None
+            and self.clock() < self.last_raid + self.raid_cooldown * 60
+        )
 
-            last_msg["occurrences"] += 1
-            if last_msg["occurrences"] >= self.max_msg_occurrences:
-                return ModerationDecision.TIMEOUT_USER
 
-        if clean_msg is not None:
-            self.last_msgs.remove(clean_msg)
+# Characters used to write around the banned words, and the letters they stand for
+LEET_SPEAK = {
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "8": "b",
+    "@": "a",
+    "$": "s",
+    "€": "e",
+}
+# Cyrillic and Greek letters that look like Latin ones
+HOMOGLYPHS = {
+    "а": "a",
+    "в": "b",
+    "е": "e",
+    "к": "k",
+    "м": "m",
+    "н": "h",
+    "о": "o",
+    "р": "p",
+    "с": "c",
+    "т": "t",
+    "у": "y",
+    "х": "x",
+    "і": "i",
+    "ј": "j",
+    "α": "a",
+    "β": "b",
+    "ε": "e",
+    "ι": "i",
+    "κ": "k",
+    "ν": "v",
+    "ο": "o",
+    "ρ": "p",
+    "τ": "t",
+    "υ": "u",
+    "χ": "x",
+}
+NORMALIZATION_TABLE = str.maketrans({**LEET_SPEAK, **HOMOGLYPHS})
+WHITESPACES = re.compile(r"\s+")
+RUNS = re.compile(r"(.)\1*", re.DOTALL)
+
+LINK = re.compile(
+    r"(?:https?://|www\.)\S+"
+    r"|\b(?:[a-z0-9-]+\.)+"
+    r"(?:com|net|org|io|gg|tv|ly|me|co|xyz|ru|fr|de|uk|info|biz|link|live|app|shop)"
+    r"\b(?:/\S*)?",
+    re.IGNORECASE,
+)
+
+
+def normalize(text: str) -> str:
+    """Reduce the text to the form in which the banned words are looked for:
+    without accents, lowercase, leet speak and homoglyphs replaced by the letters
+    they stand for, and whitespaces collapsed."""
+    if not text.isascii():
+        text = "".join(
+            char
+            for char in unicodedata.normalize("NFKD", text)
+            if not unicodedata.combining(char)
+        )
 
-        self.last_msgs.append(
-            {
-                "first-occurrence": datetime.now(),
-                "author": author,
-                "message": msg,
-                "occurrences": 1,
-            }
+    text = text.casefold().translate(NORMALIZATION_TABLE)
+    return WHITESPACES.sub(" ", text).strip()
+
+
+def trie_pattern(words: [str]) -> str:
+    """Build a regular expression matching any of the words.
+
+    The words are merged in a trie, so the expression shares their common
+    prefixes and the regex engine never tries the same prefix twice,
+    whatever the number of words.
+    Each run of a character may be longer, to catch the words written like
+    "baaad", but not shorter, so "butt" is not found in "but". The runs are
+    matched possessively, so the engine never backtracks into them.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for run in RUNS.finditer(word):
+            node = node.setdefault((run.group(1), len(run.group())), {})
+        node[""] = {}
+
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node: dict) -> str:
+    is_end = "" in node
+    branches = [
+        re.escape(char)
+        + ("++" if length == 1 else "{%d,}+" % length)
+        + _trie_node_pattern(child)
+        for (char, length), child in sorted(
+            (run, child) for run, child in node.items() if run
         )
+    ]
+
+    if not branches:
+        return ""
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+
+    pattern = "(?:%s)" % "|".join(branches)
+    return pattern + "?" if is_end else pattern
+
+
+@lru_cache(maxsize=16)
+def compile_words(words: (str,)) -> Union[None, re.Pattern]:
+    """Compile the matcher of the normalized words.
+
+    Compiling a long list of words takes a while, so the matcher is shared by
+    the channels using the same words and kept when the configuration is
+    reloaded without changing them.
+    """
+    if not words:
+        return None
+
+    return re.compile(r"(?<!\w)%s(?!\w)" % trie_pattern(words))
+
+
+class BannedWordsModerator(Moderator):
+    cost = 3
+    offload = True
+    sampled = True
+
+    def __init__(
+        self,
+        message: str,
+        decision: ModerationDecision,
+        timeout_duration: Union[None, int],
+        words: [str],
+        links: bool,
+        allowed_links: [str],
+    ):
+        super().__init__(message, decision, timeout_duration)
+
+        self.words = words
+        self.links = links
+        self.allowed_links = tuple(domain.lower() for domain in allowed_links)
+
+        words = {normalize(word) for word in words} - {""}
+        self.pattern = compile_words(tuple(sorted(words)))
+
+    def get_name(self) -> str:
+        return "Banned Words"
+
+    def vote(self, msg: str, author: str) -> ModerationDecision:
+        if self.links and self._has_forbidden_link(msg):
+            return self.decision
+
+        if self.pattern is not None and self.pattern.search(normalize(msg)):
+            return self.decision
 
         return ModerationDecision.ABSTAIN
 
-    def declare_raid(self):
-        self.last_raid = datetime.now()
+    def _has_forbidden_link(self, msg: str) -> bool:
+        for match in LINK.finditer(msg):
+            link = match.group().lower()
+            domain = link.split("://", 1)[-1].split("/", 1)[0]
+            if not any(
+                domain == allowed or domain.endswith("." + allowed)
+                for allowed in self.allowed_links
+            ):
+                return True
+
+        return False
+
+
+class ChatRate:
+    """The number of messages per second sent in a chat, as an exponentially
+    decayed average: the weight of each message halves every `half_life`
+    seconds, so the rate follows the bursts quickly without storing anything
+    per message."""
+
+    def __init__(self, half_life: float = 3):
+        self.decay = math.log(2) / half_life
+        self.value = 0.0
+        self.updated_at = None
+
+    def get(self, now: float) -> float:
+        if self.updated_at is None:
+            return 0.0
+
+        return self.value * math.exp(-self.decay * max(0.0, now - self.updated_at))
+
+    def hit(self, now: float) -> float:
+        """Count a message, and return the updated rate."""
+        self.value = self.get(now) + self.decay
+        self.updated_at = now
+        return self.value
+
+
+class AdaptivePolicy:
+    """When the moderators of a channel switch to adaptive mode, to keep up
+    with the bursts of messages.
+
+    They switch to it when the chat rate reaches `rate` messages per second or
+    the channel is raided, and back once the rate has dropped under half of it.
+    In adaptive mode, their thresholds are relaxed, the sampled moderators only
+    check one message in `sample`, and the deletions waiting for the rate limit
+    are sent in batches.
+    """
+
+    def __init__(self, rate: float = 20, sample: int = 1):
+        self.rate = rate
+        self.sample = sample
+
+    @classmethod
+    def from_dict(cls, params: dict):
+        return AdaptivePolicy(params.get("rate", 20), params.get("sample", 1))
+
+
+class ModerationPipeline:
+    """Submit the messages of a channel to its moderators.
+
+    The moderators which keep a state record every message first. Then they
+    vote from the cheapest to the most expensive one, and the first decision
+    that is not to abstain is applied without asking the following ones.
+    When an executor is given, the moderators that can be offloaded vote last,
+    in one of its threads, so they never block the event loop.
+    The rate of the chat switches the moderators to adaptive mode and back,
+    as the adaptive policy says.
+    """
+
+    def __init__(
+        self,
+        moderators: [Moderator],
+        loop: asyncio.AbstractEventLoop,
+        executor: Union[None, Executor] = None,
+        adaptive: Union[None, AdaptivePolicy] = None,
+    ):
+        self.loop = loop
+        self.executor = executor
+        self.policy = adaptive
+        self.clock = time.monotonic
+        self.rate = ChatRate()
+        self.adaptive = False
+        self.adaptive_until = 0.0
+        # The messages moderated in adaptive mode, to sample them
+        self.nb_adaptive = 0
+        self.flood = next(
+            (m for m in moderators if isinstance(m, FloodModerator)), None
+        )
+        if self.flood is not None:
+            # The adaptive mode relaxes it during raids instead
+            self.flood.disabled_on_raid = adaptive is None
+        self.recorders = [
+            moderator
+            for moderator in moderators
+            if type(moderator).record is not Moderator.record
+        ]
+
+        moderators = sorted(moderators, key=lambda moderator: moderator.cost)
+        self.moderators = moderators
+        self.inline = [m for m in moderators if executor is None or not m.offload]
+        self.offloaded = [m for m in moderators if executor is not None and m.offload]
+        # Those voting on the messages the sampled moderators skip
+        self.unsampled_inline = [m for m in self.inline if not m.sampled]
+        self.unsampled_offloaded = [m for m in self.offloaded if not m.sampled]
+
+        # The number of votes of each moderator, and the time they took
+        self.timings = {moderator: [0, 0.0] for moderator in moderators}
+
+    def moderate(
+        self,
+        msg: str,
+        author: str,
+        apply: Callable[[Moderator, ModerationDecision], None],
+    ):
+        """Call `apply` with the moderator which decided what to do with
+        the message, if any."""
+        for moderator in self.recorders:
+            moderator.record(msg, author)
+
+        inline, offloaded = self.inline, self.offloaded
+        if self.adaptive:
+            self.nb_adaptive += 1
+            if self.nb_adaptive % self.policy.sample:
+                inline, offloaded = self.unsampled_inline, self.unsampled_offloaded
+
+        for moderator in inline:
+            started_at = perf_counter()
+            vote = moderator.vote(msg, author)
+            self._record_vote(moderator, vote, perf_counter() - started_at)
+
+            if vote != ModerationDecision.ABSTAIN:
+                apply(moderator, vote)
+                return
+
+        if offloaded:
+            future = self.loop.run_in_executor(
+                self.executor, self.vote, offloaded, msg, author
+            )
+            future.add_done_callback(lambda f: self._on_offloaded_votes(f, apply))
+
+    def observe(self) -> bool:
+        """Count a message sent in the chat, and switch to adaptive mode or
+        back if the rate requires it. Return whether the mode has changed."""
+        if self.policy is None:
+            return False
+
+        now = self.clock()
+        rate = self.rate.hit(now)
+        # The raid may have been restored from the state saved before a restart
+        raided = self.flood is not None and self.flood.is_raided()
+        if not self.adaptive:
+            if rate < self.policy.rate and not raided:
+                return False
+        elif now < self.adaptive_until or rate >= self.policy.rate / 2 or raided:
+            return False
+
+        self.set_adaptive(not self.adaptive)
+        return True
+
+    def declare_raid(self) -> bool:
+        """Switch to adaptive mode before the raiders start talking.
+        Return whether the mode has changed."""
+        if self.flood is not None:
+            self.flood.declare_raid()
+        if self.policy is None:
+            return False
+
+        adaptive = self.adaptive
+        self.set_adaptive(True)
+        return not adaptive
+
+    def set_adaptive(self, adaptive: bool):
+        if adaptive:
+            self.adaptive_until = self.clock() + ADAPTIVE_MIN_DURATION
+
+        if adaptive != self.adaptive:
+            self.adaptive = adaptive
+            for moderator in self.moderators:
+                moderator.adapt(adaptive)
+
+    @staticmethod
+    def vote(
+        moderators: [Moderator], msg: str, author: str
+    ) -> [(Moderator, ModerationDecision, float)]:
+        votes = []
+        for moderator in moderators:
+            started_at = perf_counter()
+            vote = moderator.vote(msg, author)
+            votes.append((moderator, vote, perf_counter() - started_at))
+
+            if vote != ModerationDecision.ABSTAIN:
+                break
+
+        return votes
+
+    def _on_offloaded_votes(self, future: asyncio.Future, apply: Callable):
+        try:
+            votes = future.result()
+        except Exception:
+            logger.exception("A moderator failed to vote")
+            return
+
+        for moderator, vote, duration in votes:
+            self._record_vote(moderator, vote, duration)
+
+        moderator, vote, _ = votes[-1]
+        if vote != ModerationDecision.ABSTAIN:
+            apply(moderator, vote)
+
+    def _record_vote(
+        self, moderator: Moderator, vote: ModerationDecision, duration: float
+    ):
+        timing = self.timings[moderator]
+        timing[0] += 1
+        timing[1] += duration
+
+        if metrics.enabled:
+            metrics.VOTE_DURATION.observe(duration, moderator.get_name())
+            metrics.DECISIONS.inc(moderator.get_name(), vote.name)
+
+    def get_timings(self) -> {str: (int, float)}:
+        """Return the number of votes of each moderator and the time they took."""
+        return {
+            moderator.get_name(): tuple(timing)
+            for moderator, timing in self.timings.items()
+        }
+
+    def inherit_state(self, previous: "ModerationPipeline"):
+        self.rate = previous.rate
+        self.adaptive_until = previous.adaptive_until
+        self.nb_adaptive = previous.nb_adaptive
+        if previous.adaptive and self.policy is not None:
+            self.adaptive = True
+            for moderator in self.moderators:
+                moderator.adapt(True)
+
+        previous_timings = {
+            moderator.get_name(): timing
+            for moderator, timing in previous.timings.items()
+        }
+        for moderator in self.timings:
+            timing = previous_timings.get(moderator.get_name())
+            if timing is not None:
+                self.timings[moderator] = timing
@@ -0,0 +1,236 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from asyncio import AbstractEventLoop
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Callable
+
+# Twitch's limits of messages sent in a channel
+RATE_LIMIT_PERIOD = 30
+RATE_LIMIT = 20
+MODERATOR_RATE_LIMIT = 100
+# Twitch counts the messages when they arrive, a bit later than they are sent
+RATE_LIMIT_MARGIN = 0.5
+# Twitch's limit of characters in a message
+MAX_MESSAGE_LENGTH = 500
+# The number of chatters timed out whose deletions are skipped until they can
+# talk again
+MAX_TRACKED_TIMEOUTS = 10000
+
+
+class Priority(IntEnum):
+    MODERATION = 0
+    COMMAND = 1
+    TIMER = 2
+
+
+def split_message(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> [str]:
+    """Split the message in parts Twitch accepts, between words when possible."""
+    parts = []
+    while len(message) > max_length:
+        end = message.rfind(" ", 0, max_length + 1)
+        if end <= 0:
+            end = max_length
+        parts.append(message[:end])
+        message = message[end:].lstrip(" ")
+    parts.append(message)
+    return parts
+
+
+class Outbox:
+    """Send the messages of the bot without exceeding Twitch's rate limit.
+
+    The limit is enforced over a sliding window of `period` seconds, as Twitch
+    counts the messages. When it is reached, messages wait in one queue per
+    priority, and the moderation actions are sent first.
+    An identical command answer sent in the same channel less than
+    coalesce_window seconds ago is not sent again.
+    While the outbox is paused, the messages wait until it is resumed.
+    The messages too long for Twitch are sent in several parts.
+    The deletions sent with delete() are batched: when several messages of the
+    same chatter wait to be deleted, a single timeout of one second deletes
+    them all, so a burst of spam does not exhaust the rate limit. A chatter
+    timed out with timeout() has all their messages deleted already, so their
+    deletions are skipped until they can talk again.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, str], None],
+        loop: AbstractEventLoop,
+        rate: int = RATE_LIMIT,
+        period: float = RATE_LIMIT_PERIOD,
+        coalesce_window: float = 5,
+    ):
+        self._send = send
+        self.loop = loop
+        self.rate = rate
+        self.period = period
+        self.coalesce_window = coalesce_window
+
+        # When the messages of the current window were sent, oldest first
+        self.sent_at = deque()
+        # The (target, message, enqueued_at, author) of the messages to send,
+        # the author being set for the deletions only
+        self.queues = [deque() for _ in Priority]
+        # The deletions waiting to be sent, by (target, author)
+        self.pending_deletes = {}
+        # When the chatters timed out can talk again, by (target, author),
+        # most recent timeout last
+        self.timed_out = OrderedDict()
+        # When each answer was last sent, oldest first
+        self.last_answers = OrderedDict()
+        self._flush_handle = None
+        self.paused = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.batched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+    def send(self, target: str, message: str, priority: Priority):
+        if len(message) > MAX_MESSAGE_LENGTH:
+            for part in split_message(message):
+                self.send(target, part, priority)
+            return
+
+        now = self.loop.time()
+
+        if priority == Priority.COMMAND:
+            key = (target, message)
+            last_answer = self.last_answers.get(key)
+            if last_answer is not None and now - last_answer < self.coalesce_window:
+                self.coalesced += 1
+                return
+
+            self.last_answers[key] = now
+            self.last_answers.move_to_end(key)
+            while (
+                self.last_answers
+                and now - next(iter(self.last_answers.values())) >= self.coalesce_window
+            ):
+                self.last_answers.popitem(last=False)
+
+        self.queues[priority].append((target, message, now, None))
+        self.flush()
+
+    def delete(self, target: str, author: str, msg_id: str):
+        """Delete the message, along with the other messages of the author
+        still waiting to be deleted."""
+        key = (target, author)
+        now = self.loop.time()
+        timed_out_until = self.timed_out.get(key)
+        if timed_out_until is not None and timed_out_until > now:
+            self.batched += 1
+            return
+
+        pending = self.pending_deletes.get(key)
+        if pending is not None:
+            pending[1] = "/timeout %s 1" % author
+            self.batched += 1
+            return
+
+        pending = [target, "/delete %s" % msg_id, now, author]
+        self.pending_deletes[key] = pending
+        self.queues[Priority.MODERATION].append(pending)
+        self.flush()
+
+    def timeout(self, target: str, author: str, duration: int, reason: str):
+        """Time the author out, which deletes all their messages too."""
+        key = (target, author)
+        now = self.loop.time()
+        self.timed_out[key] = max(now + duration, self.timed_out.get(key, now))
+        self.timed_out.move_to_end(key)
+        while len(self.timed_out) > MAX_TRACKED_TIMEOUTS or (
+            self.timed_out and next(iter(self.timed_out.values())) <= now
+        ):
+            self.timed_out.popitem(last=False)
+
+        # Their deletions waiting to be sent are not needed anymore
+        pending = self.pending_deletes.pop(key, None)
+        if pending is not None:
+            pending[1] = None
+            self.batched += 1
+
+        self.send(
+            target,
+            "/timeout %s %d %s" % (author, duration, reason),
+            Priority.MODERATION,
+        )
+
+    def pause(self):
+        self.paused = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def resume(self):
+        self.paused = False
+        self.flush()
+
+    def flush(self):
+        if self.paused:
+            return
+
+        now = self.loop.time()
+        sent_at = self.sent_at
+        expiry = now - self.period - RATE_LIMIT_MARGIN
+        while sent_at and sent_at[0] <= expiry:
+            sent_at.popleft()
+
+        for queue in self.queues:
+            while queue and len(sent_at) < self.rate:
+                entry = queue.popleft()
+                target, message, enqueued_at, author = entry
+                if author is not None:
+                    key = (target, author)
+                    if self.pending_deletes.get(key) is entry:
+                        del self.pending_deletes[key]
+                    if message is None:
+                        # Cancelled by a timeout of the author
+                        continue
+                sent_at.append(now)
+                self._send(target, message)
+
+                wait = now - enqueued_at
+                self.sent += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+        if self._flush_handle is None and len(self) > 0:
+            # Until the oldest message of the window expires
+            delay = sent_at[0] - expiry
+            self._flush_handle = self.loop.call_later(delay, self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._flush_handle = None
+        self.flush()
+
+    def get_stats(self) -> {str: float}:
+        return {
+            "depth": len(self),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "batched": self.batched,
+            "average_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,280 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Run the moderators of the configuration over chat logs, without connecting
+to the chat, to see what they would have done."""
+
+import json
+import mmap
+import multiprocessing
+
+from typing import Iterable, Iterator
+
+from . import utils
+from .config import ChannelConfig, Config
+from .moderator import FloodModerator, ModerationDecision, ModerationPipeline
+
+# The number of lines sent at once to the processes replaying them
+BATCH_SIZE = 1000
+# The number of batches waiting for each process, before the reader waits too
+MAX_PENDING_BATCHES = 16
+
+
+class ReplayClock:
+    """The time of the message being replayed, as given by Twitch."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def read_lines(path: str, use_mmap: bool = False) -> Iterator[str]:
+    """Yield the lines of the file one by one, without their line break."""
+    with open(path, "rb") as file:
+        if use_mmap:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for line in iter(mapped.readline, b""):
+                    yield line.decode("utf-8", "replace").rstrip("\r\n")
+        else:
+            for line in file:
+                yield line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+def parse_line(line: str) -> (str, str, str, str, str):
+    """Return the tags, author, command, channel and message of a raw IRC line,
+    or None if it is not a line sent in a channel."""
+    tags = ""
+    if line.startswith("@"):
+        tags, _, line = line[1:].partition(" ")
+
+    parts = line.split(" ", 3)
+    if len(parts) < 3 or not parts[2].startswith("#"):
+        return None
+
+    mask, command, channel = parts[:3]
+    message = parts[3][1:] if len(parts) == 4 else ""
+    return tags, mask[1:].split("!", 1)[0], command, channel[1:], message
+
+
+def parse_lines(path: str, use_mmap: bool = False) -> Iterator[tuple]:
+    """Yield the parsed lines of the file sent in a channel."""
+    for line in read_lines(path, use_mmap):
+        parsed = parse_line(line)
+        if parsed is not None:
+            yield parsed
+
+
+def load_config(config_path: str) -> Config:
+    # No token is needed to stay offline
+    with open(config_path, "r") as config_file:
+        return Config.from_dict(json.load(config_file), None)
+
+
+def replay(
+    channel_configs: {str: ChannelConfig}, lines: Iterable[tuple]
+) -> {str: {str: {str: float}}}:
+    """Replay the parsed lines of the given channels, and return the statistics
+    of each moderator of each channel."""
+    clock = ReplayClock()
+    channels = {}
+    decisions = {}
+
+    for name, channel_config in channel_configs.items():
+        for moderator in channel_config.moderators:
+            if isinstance(moderator, FloodModerator):
+                moderator.clock = clock
+
+        counts = decisions[name] = {}
+
+        def apply(moderator, vote, counts=counts):
+            key = (moderator.get_name(), vote.name)
+            counts[key] = counts.get(key, 0) + 1
+
+        pipeline = ModerationPipeline(
+            channel_config.moderators, None, adaptive=channel_config.adaptive
+        )
+        pipeline.clock = clock
+        channels[name] = (channel_config, pipeline, apply)
+
+    for tags, author, command, name, message in lines:
+        channel = channels.get(name)
+        if channel is None:
+            continue
+
+        tags = utils.parse_tags(tags)
+        sent_at = tags.get("tmi-sent-ts")
+        if sent_at:
+            clock.now = int(sent_at) / 1000
+
+        channel_config, pipeline, apply = channel
+        if command == "USERNOTICE":
+            if tags.get("msg-id") == "raid":
+                pipeline.declare_raid()
+            continue
+
+        if command != "PRIVMSG":
+            continue
+
+        pipeline.observe()
+        if (
+            tags.get("mod") != "0"
+            or tags.get("emote-only", "0") == "1"
+            or channel_config.find_command(message.split(" ", 1)[0].lower())
+        ):
+            continue
+
+        pipeline.moderate(
+            utils.remove_emotes(message, tags.get("emotes")), author, apply
+        )
+
+    stats = {}
+    for name, (_, pipeline, _) in channels.items():
+        stats[name] = {}
+        for moderator, (votes, duration) in pipeline.get_timings().items():
+            stats[name][moderator] = {
+                "votes": votes,
+                "seconds": duration,
+                **{
+                    decision.name: decisions[name].get((moderator, decision.name), 0)
+                    for decision in (
+                        ModerationDecision.DELETE_MSG,
+                        ModerationDecision.TIMEOUT_USER,
+                    )
+                },
+            }
+
+    return stats
+
+
+def receive_batches(batches: multiprocessing.Queue) -> Iterator[tuple]:
+    for batch in iter(batches.get, None):
+        yield from batch
+
+
+def run_worker(
+    channel_configs: {str: ChannelConfig},
+    batches: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+):
+    lines = receive_batches(batches)
+    try:
+        results.put(replay(channel_configs, lines))
+    except Exception as e:
+        # Keep reading, so the reader is never blocked on a full queue
+        for _ in lines:
+            pass
+        results.put(e)
+
+
+def run(config_path: str, log_path: str, processes: int, use_mmap: bool):
+    channel_configs = load_config(config_path).channels
+    processes = max(1, min(processes, len(channel_configs)))
+    if processes == 1:
+        stats = replay(channel_configs, parse_lines(log_path, use_mmap))
+    else:
+        stats = dispatch(channel_configs, log_path, processes, use_mmap)
+
+    totals = {}
+    print(
+        "%-20s %-15s %10s %10s %10s %10s"
+        % ("channel", "moderator", "votes", "deleted", "timeouts", "µs/vote")
+    )
+    for channel, moderators in sorted(stats.items()):
+        for moderator, values in moderators.items():
+            print_stats(channel, moderator, values)
+
+            total = totals.setdefault(moderator, dict.fromkeys(values, 0))
+            for key, value in values.items():
+                total[key] += value
+
+    for moderator, values in totals.items():
+        print_stats("(total)", moderator, values)
+
+
+def dispatch(
+    channel_configs: {str: ChannelConfig},
+    log_path: str,
+    processes: int,
+    use_mmap: bool,
+) -> {str: {str: {str: float}}}:
+    """Read and parse the file once, and send the lines of each channel to the
+    process replaying it, in batches."""
+    assignment = {name: i % processes for i, name in enumerate(sorted(channel_configs))}
+    batches = [multiprocessing.Queue(MAX_PENDING_BATCHES) for _ in range(processes)]
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(
+                {
+                    name: channel_config
+                    for name, channel_config in channel_configs.items()
+                    if assignment[name] == worker
+                },
+                batches[worker],
+                results,
+            ),
+            daemon=True,
+        )
+        for worker in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    pending = [[] for _ in range(processes)]
+    for parsed in parse_lines(log_path, use_mmap):
+        worker = assignment.get(parsed[3])
+        if worker is None:
+            continue
+
+        batch = pending[worker]
+        batch.append(parsed)
+        if len(batch) >= BATCH_SIZE:
+            batches[worker].put(batch)
+            pending[worker] = []
+
+    for worker in range(processes):
+        batches[worker].put(pending[worker])
+        batches[worker].put(None)
+
+    stats = {}
+    for _ in workers:
+        result = results.get()
+        if isinstance(result, Exception):
+            raise result
+        stats.update(result)
+
+    for worker in workers:
+        worker.join()
+
+    return stats
+
+
+def print_stats(channel: str, moderator: str, values: {str: float}):
+    print(
+        "%-20s %-15s %10d %10d %10d %10.2f"
+        % (
+            channel,
+            moderator,
+            values["votes"],
+            values[ModerationDecision.DELETE_MSG.name],
+            values[ModerationDecision.TIMEOUT_USER.name],
+            values["seconds"] / values["votes"] * 1e6 if values["votes"] else 0,
+        )
+    )
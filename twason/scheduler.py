@@ -0,0 +1,118 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from asyncio import AbstractEventLoop
+from random import shuffle
+from typing import Callable
+
+from .config import Command, Timer, TimerStrategy
+from .log import logger
+
+
+class TimerScheduler:
+    """Send the messages of a timer from the event loop.
+
+    The scheduler wakes up when the time between two messages has elapsed.
+    If not enough messages have been sent in the chat by then, the timer
+    message is sent as soon as the last needed chat message is received.
+    """
+
+    def __init__(
+        self,
+        timer: Timer,
+        send: Callable[[Command], None],
+        loop: AbstractEventLoop,
+    ):
+        self.timer = timer
+        self.send = send
+        self.loop = loop
+        self.messages = timer.pool.copy()
+        self.position = 0
+        self.nb_messages = 0
+        self.time_elapsed = False
+        self.started_at = None
+        self._handle = None
+
+        if timer.strategy == TimerStrategy.SHUFFLE:
+            shuffle(self.messages)
+
+    def start(self, started_at: float = None):
+        if started_at is None:
+            started_at = self.loop.time()
+
+        self.started_at = started_at
+        self._handle = self.loop.call_at(
+            started_at + self.timer.time_between * 60, self._on_time_elapsed
+        )
+
+    def inherit_state(self, previous: "TimerScheduler"):
+        """Take the live state over from the scheduler this one replaces
+        when the configuration is reloaded, then start."""
+        self.restore(
+            previous.position,
+            previous.nb_messages,
+            previous.time_elapsed,
+            previous.started_at,
+        )
+
+    def restore(
+        self, position: int, nb_messages: int, time_elapsed: bool, started_at: float
+    ):
+        """Resume from the given state, `started_at` being a time of the loop."""
+        self.stop()
+        self.position = position % len(self.messages)
+        self.nb_messages = nb_messages
+        self.time_elapsed = time_elapsed
+
+        if not self.time_elapsed:
+            self.start(started_at)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def on_message(self):
+        self.nb_messages += 1
+        if self.time_elapsed and self.nb_messages >= self.timer.msgs_between:
+            self.play()
+
+    def _on_time_elapsed(self):
+        self._handle = None
+        self.time_elapsed = True
+        if self.nb_messages >= self.timer.msgs_between:
+            self.play()
+
+    def next_command(self) -> Command:
+        command = self.messages[self.position]
+
+        self.position += 1
+        if self.position == len(self.messages):
+            self.position = 0
+            if self.timer.strategy == TimerStrategy.SHUFFLE:
+                logger.debug("Shuffle!")
+                shuffle(self.messages)
+
+        return command
+
+    def play(self):
+        self.send(self.next_command())
+
+        self.nb_messages = 0
+        self.time_elapsed = False
+        self.stop()
+        self.start()
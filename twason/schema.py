@@ -0,0 +1,316 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""The schema of the JSON configuration, checked before anything is built from
+it so all the mistakes are reported at once, with where they are."""
+
+from .log import logger
+from .template import COMMAND_VARIABLES, MODERATOR_VARIABLES, VARIABLE
+
+
+class ConfigError(ValueError):
+    def __init__(self, errors: [str]):
+        super().__init__(
+            "the configuration is invalid:\n%s"
+            % "\n".join("  - %s" % error for error in errors)
+        )
+        self.errors = errors
+
+
+def describe(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "a boolean"
+    if isinstance(value, (int, float)):
+        return "a number"
+    if isinstance(value, str):
+        return "a string"
+    if isinstance(value, list):
+        return "a list"
+    return "an object"
+
+
+class Field:
+    expected = "a value"
+
+    def __init__(self, nullable: bool = False):
+        self.nullable = nullable
+
+    def check(self, value, path: str, errors: [str]):
+        if value is None and self.nullable:
+            return
+
+        if not self.accepts(value):
+            errors.append(
+                "%s: expected %s, got %s" % (path, self.expected, describe(value))
+            )
+            return
+
+        self.check_value(value, path, errors)
+
+    def accepts(self, value) -> bool:
+        return True
+
+    def check_value(self, value, path: str, errors: [str]):
+        pass
+
+
+class Boolean(Field):
+    expected = "a boolean"
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, bool)
+
+
+class String(Field):
+    expected = "a string"
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, str)
+
+
+class Number(Field):
+    expected = "a number"
+
+    def __init__(
+        self,
+        minimum: float = None,
+        maximum: float = None,
+        above: float = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.above = above
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def check_value(self, value, path: str, errors: [str]):
+        if self.minimum is not None and value < self.minimum:
+            errors.append(
+                "%s: must be at least %s, got %s" % (path, self.minimum, value)
+            )
+        if self.above is not None and value <= self.above:
+            errors.append(
+                "%s: must be greater than %s, got %s" % (path, self.above, value)
+            )
+        if self.maximum is not None and value > self.maximum:
+            errors.append(
+                "%s: must be at most %s, got %s" % (path, self.maximum, value)
+            )
+
+
+class Integer(Number):
+    expected = "an integer"
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, int) and not isinstance(value, bool)
+
+
+class Choice(Field):
+    def __init__(self, *choices: str, **kwargs):
+        super().__init__(**kwargs)
+        self.choices = choices
+        self.expected = " or ".join('"%s"' % choice for choice in choices)
+
+    def accepts(self, value) -> bool:
+        return value in self.choices
+
+
+class Message(String):
+    """A message template, only using the variables it has access to."""
+
+    def __init__(self, variables: {str}, **kwargs):
+        super().__init__(**kwargs)
+        self.variables = variables
+
+    def check_value(self, value: str, path: str, errors: [str]):
+        for match in VARIABLE.finditer(value):
+            if match[1] not in self.variables:
+                errors.append(
+                    "%s: unknown variable {%s}, available variables: %s"
+                    % (
+                        path,
+                        match[1],
+                        ", ".join("{%s}" % v for v in sorted(self.variables)),
+                    )
+                )
+
+
+class List(Field):
+    def __init__(self, item: Field, **kwargs):
+        super().__init__(**kwargs)
+        self.item = item
+        self.expected = "a list"
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, list)
+
+    def check_value(self, value: list, path: str, errors: [str]):
+        for i, item in enumerate(value):
+            self.item.check(item, "%s[%d]" % (path, i), errors)
+
+
+class Object(Field):
+    expected = "an object"
+
+    def __init__(self, fields: {str: Field}, required: (str,) = (), **kwargs):
+        super().__init__(**kwargs)
+        self.fields = fields
+        self.required = required
+
+    def accepts(self, value) -> bool:
+        return isinstance(value, dict)
+
+    def check_value(self, value: dict, path: str, errors: [str]):
+        prefix = "%s." % path if path else ""
+
+        for key in self.required:
+            if key not in value:
+                errors.append("%s%s: missing" % (prefix, key))
+
+        for key, item in value.items():
+            field = self.fields.get(key)
+            if field is None:
+                # Unknown options are harmless, but often misspelled ones
+                logger.warning(
+                    "%s%s is not a known option, it has been ignored!",
+                    prefix,
+                    key,
+                )
+                continue
+
+            field.check(item, "%s%s" % (prefix, key), errors)
+
+
+def command(required: (str,)) -> Object:
+    return Object(
+        {
+            "name": String(),
+            "aliases": List(String()),
+            "message": Message(COMMAND_VARIABLES),
+            "disabled": Boolean(),
+            "cooldown": Number(minimum=0),
+            "user-cooldown": Number(minimum=0),
+        },
+        required,
+    )
+
+
+def moderator(fields: {str: Field}) -> Object:
+    return Object(
+        {
+            "activate": Boolean(),
+            "decision": Choice("delete", "timeout"),
+            "duration": Integer(minimum=1, nullable=True),
+            "message": Message(MODERATOR_VARIABLES),
+            **fields,
+        }
+    )
+
+
+TIMER = Object(
+    {
+        # Without any time between them, the messages would be sent endlessly
+        "between": Object({"time": Number(above=0), "messages": Integer(minimum=0)}),
+        "strategy": Choice("round-robin", "shuffle"),
+        # The messages of the timers don't need a name
+        "pool": List(command(("message",))),
+    }
+)
+
+CHANNEL_FIELDS = {
+    "channel": String(),
+    "command_prefix": String(),
+    "help": Boolean(),
+    "commands": List(command(("name", "message"))),
+    "timer": TIMER,
+    "timers": List(TIMER),
+    "moderator": Object(
+        {
+            "caps-lock": moderator(
+                {
+                    "min-size": Integer(minimum=0),
+                    "threshold": Number(minimum=0, maximum=100),
+                }
+            ),
+            "flood": moderator(
+                {
+                    "max-word-length": Integer(minimum=1, nullable=True),
+                    "raid-cooldown": Number(minimum=0, nullable=True),
+                    "ignore-hashtags": Boolean(),
+                    "max-msg-occurrences": Integer(minimum=1, nullable=True),
+                    "min-time-between-occurrence": Number(minimum=0, nullable=True),
+                    "max-tracked-authors": Integer(minimum=1),
+                }
+            ),
+            "banned-words": moderator(
+                {
+                    "words": List(String()),
+                    "links": Boolean(),
+                    "allowed-links": List(String()),
+                }
+            ),
+        }
+    ),
+    "strikes": Object(
+        {
+            "max": Integer(minimum=1),
+            "duration": Integer(minimum=1),
+            "expiry": Number(minimum=0),
+        }
+    ),
+    "max-tracked-chatters": Integer(minimum=1),
+    "chatter-ttl": Number(minimum=0),
+    "adaptive": Object(
+        {"rate": Number(minimum=0), "sample": Integer(minimum=1)}, nullable=True
+    ),
+}
+
+CONFIG = Object(
+    {
+        **CHANNEL_FIELDS,
+        "nickname": String(),
+        "bot_is_moderator": Boolean(),
+        "metrics": Object(
+            {"host": String(), "port": Integer(minimum=0, maximum=65535)},
+            nullable=True,
+        ),
+        "moderation_threads": Integer(minimum=0),
+        "channels": List(Object(CHANNEL_FIELDS, ("channel",))),
+    },
+    ("nickname",),
+)
+
+
+def validate(params: dict):
+    """Check the whole configuration in a single pass, and raise a ConfigError
+    listing all the mistakes found, if any."""
+    if not isinstance(params, dict):
+        raise ConfigError(["expected an object, got %s" % describe(params)])
+
+    errors = []
+    CONFIG.check(params, "", errors)
+
+    if "channels" not in params and "channel" not in params:
+        errors.append('channel: missing (or "channels" to follow several channels)')
+
+    if errors:
+        raise ConfigError(errors)
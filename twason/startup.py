@@ -0,0 +1,56 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from time import perf_counter
+
+from .log import logger
+
+
+class StartupTimer:
+    """Measure how long each step of the startup takes, until the bot has
+    joined its channels, to log where the time went."""
+
+    def __init__(self, started_at: float = None):
+        self.started_at = started_at if started_at is not None else perf_counter()
+        self.last_step_at = self.started_at
+        self.steps = []
+        self.done = False
+
+    def step(self, name: str):
+        """Record the time taken since the previous step, under the name of
+        the step that has just ended."""
+        if self.done:
+            return
+
+        now = perf_counter()
+        self.steps.append((name, now - self.last_step_at))
+        self.last_step_at = now
+
+    def finish(self, name: str):
+        if self.done:
+            return
+
+        self.step(name)
+        self.done = True
+
+        logger.info(
+            "In the chat %.0f ms after starting (%s)",
+            (self.last_step_at - self.started_at) * 1e3,
+            ", ".join(
+                "%s: %.0f ms" % (name, duration * 1e3) for name, duration in self.steps
+            ),
+        )
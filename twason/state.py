@@ -0,0 +1,225 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import sqlite3
+import threading
+import time
+
+from typing import Union
+
+from .moderator import FloodModerator
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS raids (
+    channel TEXT PRIMARY KEY,
+    last_raid REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    channel TEXT NOT NULL,
+    author TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    key INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_channel ON messages (channel, sent_at);
+CREATE TABLE IF NOT EXISTS timers (
+    channel TEXT NOT NULL,
+    timer INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    nb_messages INTEGER NOT NULL,
+    time_elapsed INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    PRIMARY KEY (channel, timer)
+);
+"""
+
+
+class ChannelState:
+    """The live state of a channel, with the times as Unix timestamps.
+
+    When taken from a running channel, `messages` only holds the messages
+    received since the previous snapshot.
+    """
+
+    __slots__ = ("channel", "last_raid", "messages", "expiry", "timers")
+
+    def __init__(
+        self,
+        channel: str,
+        last_raid: Union[None, float] = None,
+        messages: [(str, float, int)] = None,
+        expiry: float = 0,
+        timers: [(int, int, bool, float)] = None,
+    ):
+        self.channel = channel
+        self.last_raid = last_raid
+        # (author, sent at, message key)
+        self.messages = messages if messages is not None else []
+        # The messages sent before this time are not needed anymore
+        self.expiry = expiry
+        # (position, number of messages, time elapsed, started at)
+        self.timers = timers if timers is not None else []
+
+
+def _find_flood_moderator(channel) -> Union[None, FloodModerator]:
+    for moderator in channel.config.moderators:
+        if isinstance(moderator, FloodModerator):
+            return moderator
+
+    return None
+
+
+def snapshot(channel) -> ChannelState:
+    """Take the state of the channel that changed since the previous snapshot."""
+    now = time.time()
+    state = ChannelState(channel.config.channel)
+
+    flood = _find_flood_moderator(channel)
+    if flood is not None:
+        offset = now - flood.clock()
+        history = flood.last_msgs
+        journal = history.journal or []
+        history.journal = []
+
+        state.messages = [
+            (author, sent_at + offset, key) for author, sent_at, key in journal
+        ]
+        state.expiry = now - history.window
+        if flood.last_raid is not None:
+            state.last_raid = flood.last_raid + offset
+
+    for timer in channel.timers:
+        started_at = timer.started_at
+        if started_at is not None:
+            started_at += now - timer.loop.time()
+        state.timers.append(
+            (timer.position, timer.nb_messages, timer.time_elapsed, started_at or 0)
+        )
+
+    return state
+
+
+def restore(channel, state: ChannelState):
+    """Resume the channel from its saved state."""
+    now = time.time()
+
+    flood = _find_flood_moderator(channel)
+    if flood is not None:
+        offset = flood.clock() - now
+        history = flood.last_msgs
+        if state.last_raid is not None:
+            flood.last_raid = state.last_raid + offset
+
+        for author, sent_at, key in state.messages:
+            if sent_at > now - history.window:
+                history.add_key(author, key, sent_at + offset)
+        # Only journal the messages received from now on
+        history.journal = []
+
+    for timer, (position, nb_messages, time_elapsed, started_at) in zip(
+        channel.timers, state.timers
+    ):
+        timer.restore(
+            position,
+            nb_messages,
+            time_elapsed,
+            started_at + timer.loop.time() - now,
+        )
+
+
+class StateStore:
+    """A SQLite database in which the state of the channels is saved.
+
+    The messages are inserted as they come and deleted once they have expired,
+    so every save only writes what changed since the previous one.
+    Several workers can share the same database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        try:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript(SCHEMA)
+        except sqlite3.Error:
+            self.connection.close()
+            raise
+
+    def load(self, channel: str) -> ChannelState:
+        with self.lock:
+            raid = self.connection.execute(
+                "SELECT last_raid FROM raids WHERE channel = ?", (channel,)
+            ).fetchone()
+            messages = self.connection.execute(
+                "SELECT author, sent_at, key FROM messages"
+                " WHERE channel = ? ORDER BY sent_at",
+                (channel,),
+            ).fetchall()
+            timers = self.connection.execute(
+                "SELECT position, nb_messages, time_elapsed, started_at FROM timers"
+                " WHERE channel = ? ORDER BY timer",
+                (channel,),
+            ).fetchall()
+
+        return ChannelState(
+            channel,
+            raid[0] if raid is not None else None,
+            messages,
+            timers=[
+                (position, nb_messages, bool(time_elapsed), started_at)
+                for position, nb_messages, time_elapsed, started_at in timers
+            ],
+        )
+
+    def save(self, states: [ChannelState]):
+        with self.lock, self.connection:
+            for state in states:
+                self.connection.execute(
+                    "DELETE FROM messages WHERE channel = ? AND sent_at <= ?",
+                    (state.channel, state.expiry),
+                )
+                self.connection.executemany(
+                    "INSERT INTO messages VALUES (?, ?, ?, ?)",
+                    [(state.channel, *message) for message in state.messages],
+                )
+
+                if state.last_raid is None:
+                    self.connection.execute(
+                        "DELETE FROM raids WHERE channel = ?", (state.channel,)
+                    )
+                else:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO raids VALUES (?, ?)",
+                        (state.channel, state.last_raid),
+                    )
+
+                self.connection.execute(
+                    "DELETE FROM timers WHERE channel = ? AND timer >= ?",
+                    (state.channel, len(state.timers)),
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO timers VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (state.channel, i, *timer)
+                        for i, timer in enumerate(state.timers)
+                    ],
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
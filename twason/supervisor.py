@@ -0,0 +1,427 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+from bisect import bisect
+from typing import Union
+
+from . import log
+from .config import get_config
+from .log import logger
+from .startup import StartupTimer
+
+STATS_INTERVAL = 60
+RESPAWN_DELAY = 5
+MAX_RESPAWN_DELAY = 300
+
+
+class HashRing:
+    """Consistent hashing of the channels on the workers.
+
+    Adding or removing a worker only moves the channels of this worker.
+    """
+
+    def __init__(self, replicas: int = 64):
+        self.replicas = replicas
+        self.hashes = []
+        self.nodes = {}
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add(self, node: int):
+        for i in range(self.replicas):
+            h = self._hash("%s-%d" % (node, i))
+            self.nodes[h] = node
+            self.hashes.insert(bisect(self.hashes, h), h)
+
+    def remove(self, node: int):
+        for i in range(self.replicas):
+            h = self._hash("%s-%d" % (node, i))
+            del self.nodes[h]
+            self.hashes.remove(h)
+
+    def get(self, key: str) -> Union[None, int]:
+        if not self.hashes:
+            return None
+
+        i = bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.nodes[self.hashes[i]]
+
+
+class QueueWriter:
+    """A file-like object sending each line written to the supervisor."""
+
+    def __init__(self, events: multiprocessing.Queue, worker_id: int):
+        self.events = events
+        self.worker_id = worker_id
+        self.buffer = ""
+
+    def write(self, data: str) -> int:
+        lines = (self.buffer + data).split("\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self.events.put(("log", self.worker_id, line))
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def run_worker(
+    worker_id: int,
+    config_path: str,
+    channels: [str],
+    commands: multiprocessing.Queue,
+    events: multiprocessing.Queue,
+    log_level: str,
+    log_format: str,
+    state_file: str = None,
+    state_interval: float = 0,
+    server: (str, int, bool) = None,
+    nb_workers: int = 1,
+):
+    startup = StartupTimer()
+    sys.stdout = QueueWriter(events, worker_id)
+    log.setup(
+        log_level, log_format, prefix="[worker %d] " % worker_id, worker=worker_id
+    )
+
+    from . import twitchbot
+
+    startup.step("imports")
+    config = get_config(config_path)
+    config.channels = {name: config.channels[name] for name in channels}
+    if config.metrics is not None:
+        # Each worker serves its own metrics, on the following ports
+        config.metrics = {
+            **config.metrics,
+            "port": config.metrics.get("port", 9100) + worker_id,
+        }
+
+    startup.step("configuration")
+    bot = twitchbot.create_bot(config, server)
+    plugin = bot.get_plugin(twitchbot.TwitchBot)
+    plugin.only_channels = set(channels)
+    plugin.set_nb_workers(nb_workers)
+    plugin.startup = startup
+    startup.step("setup")
+
+    def on_command(action: str, channel: str):
+        if action == "join":
+            if channel not in plugin.available_channels:
+                # The channel has been added to the configuration file
+                # before this worker reloaded it
+                plugin.available_channels = get_config(config_path).channels
+            plugin.only_channels.add(channel)
+            # The moderators keep their state when the channel is left, so they
+            # would count the restored messages twice if the channel came back
+            plugin.add_channel(plugin.available_channels[channel].renew())
+        elif action == "part":
+            plugin.only_channels.discard(channel)
+            plugin.remove_channel(channel)
+
+    def listen_commands():
+        while True:
+            action, channel = commands.get()
+            bot.loop.call_soon_threadsafe(on_command, action, channel)
+
+    def send_stats():
+        events.put(("stats", worker_id, plugin.get_stats()))
+        bot.loop.call_later(STATS_INTERVAL, send_stats)
+
+    threading.Thread(target=listen_commands, daemon=True).start()
+    bot.loop.call_later(STATS_INTERVAL, send_stats)
+    if state_interval > 0:
+        plugin.enable_state(state_file, state_interval)
+    bot.run(forever=True)
+    plugin.close_state()
+
+
+class Worker:
+    def __init__(
+        self,
+        worker_id: int,
+        config_path: str,
+        channels: {str},
+        events: multiprocessing.Queue,
+        log_level: str,
+        log_format: str,
+        state_file: str = None,
+        state_interval: float = 0,
+        server: (str, int, bool) = None,
+        nb_workers: int = 1,
+    ):
+        self.id = worker_id
+        self.channels = channels
+        self.commands = multiprocessing.Queue()
+        self.started_at = time.monotonic()
+        self.process = multiprocessing.Process(
+            target=run_worker,
+            args=(
+                worker_id,
+                config_path,
+                sorted(channels),
+                self.commands,
+                events,
+                log_level,
+                log_format,
+                state_file,
+                state_interval,
+                server,
+                nb_workers,
+            ),
+            name="twason-worker-%d" % worker_id,
+            daemon=True,
+        )
+        self.process.start()
+
+
+class Supervisor:
+    """Spread the channels over several worker processes, each of them running
+    its own bot, and restart the workers that die."""
+
+    def __init__(
+        self,
+        config_path: str,
+        nb_workers: int,
+        log_level: str,
+        log_format: str,
+        reload_interval: float = 0,
+        state_file: str = None,
+        state_interval: float = 0,
+        server: (str, int, bool) = None,
+    ):
+        self.config_path = config_path
+        self.reload_interval = reload_interval
+        self.reload_requested = False
+        self.config_mtime = os.stat(config_path).st_mtime
+        self.nb_workers = nb_workers
+        self.log_level = log_level
+        self.log_format = log_format
+        self.state_file = state_file
+        self.state_interval = state_interval
+        self.server = server
+        config = get_config(config_path)
+        self.config_digest = config.digest
+        self.channels = list(config.channels)
+        self.events = multiprocessing.Queue()
+        self.ring = HashRing()
+        self.workers = {}
+        self.stats = {}
+        self.respawn_delay = RESPAWN_DELAY
+        self.respawn_at = None
+
+    def assign(self) -> {int: {str}}:
+        assignment = {worker_id: set() for worker_id in self.ring.nodes.values()}
+        for channel in self.channels:
+            assignment[self.ring.get(channel)].add(channel)
+
+        return assignment
+
+    def rebalance(self, new_workers: [int] = ()):
+        """Start the new workers and move the channels to the workers they
+        are now assigned to."""
+        assignment = self.assign()
+
+        for worker_id, worker in self.workers.items():
+            for channel in worker.channels - assignment[worker_id]:
+                worker.commands.put(("part", channel))
+
+        for worker_id, worker in self.workers.items():
+            for channel in assignment[worker_id] - worker.channels:
+                worker.commands.put(("join", channel))
+            worker.channels = assignment[worker_id]
+
+        for worker_id in new_workers:
+            self.workers[worker_id] = Worker(
+                worker_id,
+                self.config_path,
+                assignment[worker_id],
+                self.events,
+                self.log_level,
+                self.log_format,
+                self.state_file,
+                self.state_interval,
+                self.server,
+                self.nb_workers,
+            )
+            logger.info(
+                "[supervisor] worker %d started with %d channels",
+                worker_id,
+                len(assignment[worker_id]),
+            )
+
+    def spawn(self):
+        """Start the missing workers.
+
+        A restarted worker gets back the id of the one it replaces,
+        and thus the same channels."""
+        new_workers = []
+        for worker_id in range(self.nb_workers):
+            if worker_id not in self.workers:
+                self.ring.add(worker_id)
+                new_workers.append(worker_id)
+
+        self.rebalance(new_workers)
+
+    def check_workers(self):
+        dead = [w for w in self.workers.values() if not w.process.is_alive()]
+        for worker in dead:
+            logger.warning(
+                "[supervisor] worker %d died (exit code %s), moving its %d channels",
+                worker.id,
+                worker.process.exitcode,
+                len(worker.channels),
+            )
+            del self.workers[worker.id]
+            self.stats.pop(worker.id, None)
+            self.ring.remove(worker.id)
+
+            # Back off if the workers keep dying right after being started
+            if time.monotonic() - worker.started_at < self.respawn_delay:
+                self.respawn_delay = min(self.respawn_delay * 2, MAX_RESPAWN_DELAY)
+            else:
+                self.respawn_delay = RESPAWN_DELAY
+            self.respawn_at = time.monotonic() + self.respawn_delay
+
+        if dead and self.workers:
+            self.rebalance()
+
+        if self.respawn_at is not None and time.monotonic() >= self.respawn_at:
+            self.respawn_at = None
+            self.spawn()
+
+    def print_stats(self):
+        total = {}
+        for stats in self.stats.values():
+            for key, value in stats.items():
+                if key == "max_wait":
+                    total[key] = max(total.get(key, 0), value)
+                elif key != "average_wait":
+                    total[key] = total.get(key, 0) + value
+
+        logger.info(
+            "[supervisor] %d workers: %s",
+            len(self.workers),
+            ", ".join("%s=%s" % (key, value) for key, value in total.items()),
+        )
+
+    def request_reload(self, *_):
+        self.reload_requested = True
+
+    def reload(self):
+        """Make the workers reload the configuration, and move the channels
+        that have been added or removed."""
+        self.reload_requested = False
+        try:
+            config = get_config(self.config_path, self.config_digest)
+        except Exception as error:
+            logger.error(
+                "[supervisor] The configuration could not be reloaded: %s", error
+            )
+            return
+
+        if config is None:
+            logger.info("[supervisor] The configuration has not changed")
+            return
+
+        self.config_digest = config.digest
+        self.channels = list(config.channels)
+
+        logger.info("[supervisor] Reloading the configuration")
+        for worker in self.workers.values():
+            os.kill(worker.process.pid, signal.SIGHUP)
+        self.rebalance()
+
+    def check_config(self):
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except OSError:
+            return
+
+        if mtime != self.config_mtime:
+            self.config_mtime = mtime
+            self.reload()
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.request_reload)
+        self.spawn()
+        next_stats = time.monotonic() + STATS_INTERVAL
+        next_config_check = time.monotonic() + self.reload_interval
+
+        try:
+            while True:
+                try:
+                    kind, worker_id, payload = self.events.get(timeout=1)
+                    if kind == "log":
+                        # The workers' logs are already formatted
+                        sys.stdout.write(payload + "\n")
+                    elif kind == "stats":
+                        self.stats[worker_id] = payload
+                except queue.Empty:
+                    pass
+
+                self.check_workers()
+
+                if self.reload_requested:
+                    self.reload()
+                if 0 < self.reload_interval and time.monotonic() >= next_config_check:
+                    self.check_config()
+                    next_config_check += self.reload_interval
+
+                if time.monotonic() >= next_stats:
+                    self.print_stats()
+                    next_stats += STATS_INTERVAL
+        except KeyboardInterrupt:
+            for worker in self.workers.values():
+                worker.process.terminate()
+            # Let the workers save their state
+            for worker in self.workers.values():
+                worker.process.join()
+
+
+def run(
+    config_path: str,
+    nb_workers: int,
+    log_level: str,
+    log_format: str,
+    reload_interval: float = 0,
+    state_file: str = None,
+    state_interval: float = 0,
+    server: (str, int, bool) = None,
+):
+    Supervisor(
+        config_path,
+        nb_workers,
+        log_level,
+        log_format,
+        reload_interval,
+        state_file,
+        state_interval,
+        server,
+    ).run()
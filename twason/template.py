@@ -0,0 +1,59 @@
+# Twason - The KISS Twitch bot
+# Copyright (C) 2021  Jérôme Deuchnord
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import re
+
+# The variables the messages can use, written as {name}
+COMMAND_VARIABLES = {"author", "channel", "count", "uptime", "args", "target"}
+MODERATOR_VARIABLES = {"author", "channel"}
+
+VARIABLE = re.compile(r"\{([a-z]+)\}")
+
+
+class Template:
+    """A message in which variables are replaced when it is sent.
+
+    The message is compiled once in a %-format string, so rendering it is
+    a single operation whatever the number of variables.
+    """
+
+    __slots__ = ("message", "format", "variables")
+
+    def __init__(self, message: str, variables: {str} = frozenset(COMMAND_VARIABLES)):
+        self.message = message
+        self.variables = set()
+
+        parts = []
+        position = 0
+        for match in VARIABLE.finditer(message):
+            name = match[1]
+            if name not in variables:
+                raise ValueError(
+                    "unknown variable {%s} in message %r, available variables: %s"
+                    % (name, message, ", ".join("{%s}" % v for v in sorted(variables)))
+                )
+
+            parts.append(message[position : match.start()].replace("%", "%%"))
+            parts.append("%%(%s)s" % name)
+            self.variables.add(name)
+            position = match.end()
+
+        parts.append(message[position:].replace("%", "%%"))
+        self.format = "".join(parts)
+
+    def render(self, values: {str: str}) -> str:
+        return self.format % values
@@ -16,6 +16,7 @@
 
 from irc3.rfc import raw
 
+RECONNECT = r"^(@(?P<tags>\S+) )?:(?P<mask>\S+) RECONNECT$"
 USERNOTICE = (
     r"^(@(?P<tags>\S+) )?:(?P<mask>\S+) (?P<event>(USERNOTICE)) (?P<target>\S+)$"
 )
@@ -16,51 +16,479 @@
 
 
 import irc3
+import os
+import signal
+import sqlite3
 
-from random import shuffle
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
 
+from . import metrics
+from . import state
 from . import utils
-
-from .config import TimerStrategy
-from .moderator import ModerationDecision, Moderator, FloodModerator
+from .log import logger
+
+from .chatters import Chatter, ChatterRegistry
+from .connection import TwitchConnection, TwitchIrcBot
+from .cooldown import CommandCooldowns
+from .config import Command, Config, ChannelConfig, get_config
+from .scheduler import TimerScheduler
+from .outbox import (
+    Outbox,
+    Priority,
+    MAX_MESSAGE_LENGTH,
+    RATE_LIMIT,
+    RATE_LIMIT_PERIOD,
+    MODERATOR_RATE_LIMIT,
+)
+from .moderator import (
+    ModerationDecision,
+    ModerationPipeline,
+    Moderator,
+)
 from . import twitch_message
 
+# The time given to the new session to join the channels before sending anyway
+JOIN_TIMEOUT = 10
+# Twitch lets the bots join 20 channels every 10 seconds
+JOIN_RATE_LIMIT = 20
+JOIN_RATE_LIMIT_PERIOD = 10
+
+
+def share_rate_limit(limit: int, period: float, nb_workers: int) -> (int, float):
+    """Return the share of a rate limit of the account each worker gets, as the
+    number of lines it can send in a period.
+
+    All the workers are logged in as the same account, so Twitch counts their
+    lines together. When there are more workers than lines, each of them gets
+    a single line over a longer period.
+    """
+    if nb_workers <= limit:
+        return limit // nb_workers, period
+
+    return 1, period * nb_workers / limit
+
+
+TWITCH_IRC_SERVER = "irc.chat.twitch.tv"
+TWITCH_IRC_PORT = 6697
+
 config = None
 
 
-@irc3.plugin
+class Channel:
+    def __init__(self, channel_config: ChannelConfig):
+        self.name = "#%s" % channel_config.channel
+        self.config = channel_config
+        self.timers = []
+        self.moderation = None
+        self.commands_count = {}
+        self.cooldowns = CommandCooldowns()
+        self.chatters = ChatterRegistry(
+            channel_config.max_tracked_chatters, channel_config.chatter_ttl
+        )
+
+
 class TwitchBot:
     def __init__(self, bot: irc3.IrcBot):
         self.config = config
-        self.messages_stack = []
+        self.channels = {}
+        # All the channels of the configuration file, and those this bot
+        # follows when other ones share the same file (None if all)
+        self.available_channels = dict(self.config.channels)
+        self.only_channels = None
         self.bot = bot
         self.log = self.bot.log
-        self.last_timer_date = datetime.now()
-        self.nb_messages_since_timer = 0
+        self.started_at = monotonic()
+        self.nb_messages = 0
+        # The number of workers sharing the rate limits of the account
+        self.nb_workers = 1
+        self.join_rate = JOIN_RATE_LIMIT
+        self.join_period = JOIN_RATE_LIMIT_PERIOD
+        self.outbox = Outbox(
+            # The outbox already takes care of the rate limit,
+            # so bypass irc3's flood protection queue
+            lambda target, message: self.bot.privmsg(target, message, nowait=True),
+            self.bot.loop,
+            MODERATOR_RATE_LIMIT if self.config.bot_is_moderator else RATE_LIMIT,
+        )
+        # The channels the current session has still to join (None once joined)
+        self.pending_joins = None
+        self._join_timeout = None
+        self._next_joins = None
+        # The ids of the messages received while two connections are open
+        self.overlap_ids = None
+        self.disconnected_at = None
+        self.downtime = 0.0
+        # Set to log how long the bot took to join the channels once started
+        self.startup = None
+
+        # Where the state of the channels is saved (None if it is not)
+        self.state = None
+        self.state_executor = None
+        # The threads in which the expensive moderators vote (none if 0)
+        self.moderation_executor = (
+            ThreadPoolExecutor(
+                self.config.moderation_threads, thread_name_prefix="moderation"
+            )
+            if self.config.moderation_threads > 0
+            else None
+        )
+
+        for channel_config in self.config.channels.values():
+            self.start_channel(Channel(channel_config))
+
+        if self.config.metrics is not None:
+            metrics.start(
+                self.bot.loop,
+                self.config.metrics.get("host", "127.0.0.1"),
+                self.config.metrics.get("port", 9100),
+            )
+            metrics.OUTBOX_DEPTH.read_from(lambda: len(self.outbox))
+            metrics.FLOOD_HISTORY_SIZE.read_from(self.get_flood_history_size)
+            metrics.ADAPTIVE_CHANNELS.read_from(
+                lambda: sum(c.moderation.adaptive for c in self.channels.values())
+            )
+
+        # Reload the configuration instead of irc3's plugins on SIGHUP
+        self.bot.SIGHUP = self.request_reload
+        self._config_mtime = None
 
     def connection_made(self):
-        print("connected")
+        logger.info("connected")
+        if self.startup is not None:
+            self.startup.step("connection")
 
     def server_ready(self):
-        print("ready")
+        logger.info("ready")
 
     def connection_lost(self):
-        print("connection lost")
+        logger.warning("connection lost")
+        if metrics.enabled:
+            metrics.RECONNECTIONS.inc()
+        self.suspend_sending()
+
+    def suspend_sending(self):
+        """Keep the messages in the outbox until the new session has joined
+        the channels."""
+        self.outbox.pause()
+        if self.disconnected_at is None:
+            self.disconnected_at = monotonic()
+
+    def on_session_ready(self):
+        if self.pending_joins is None:
+            return
+
+        self.pending_joins = None
+        self._join_timeout.cancel()
+        self.overlap_ids = None
+        self.bot.connection_ready()
+        if self.startup is not None:
+            self.startup.finish("join")
+
+        if self.disconnected_at is not None:
+            downtime = monotonic() - self.disconnected_at
+            self.disconnected_at = None
+            self.downtime += downtime
+            if metrics.enabled:
+                metrics.DOWNTIME.inc(value=downtime)
+            logger.info(
+                "Sending the %d messages queued in %.1f seconds of downtime",
+                len(self.outbox),
+                downtime,
+            )
+
+        self.outbox.resume()
+
+    def create_timers(self, channel: Channel) -> [TimerScheduler]:
+        def send_timer_message(command: Command):
+            message = self.render_command(channel, command, self.config.nickname)
+            logger.info("%s Timer: %s", channel.name, message)
+            self.outbox.send(channel.name, message, Priority.TIMER)
+
+        return [
+            TimerScheduler(timer, send_timer_message, self.bot.loop)
+            for timer in channel.config.timers
+        ]
+
+    def create_moderation(self, channel: Channel) -> ModerationPipeline:
+        return ModerationPipeline(
+            channel.config.moderators,
+            self.bot.loop,
+            self.moderation_executor,
+            channel.config.adaptive,
+        )
+
+    def start_channel(self, channel: Channel):
+        channel.moderation = self.create_moderation(channel)
+        channel.timers = self.create_timers(channel)
+        for timer in channel.timers:
+            timer.start()
+        if self.state is not None:
+            state.restore(channel, self.state.load(channel.config.channel))
+
+        self.channels[channel.name] = channel
+
+    def add_channel(self, channel_config: ChannelConfig):
+        channel = Channel(channel_config)
+        if channel.name in self.channels:
+            return
+
+        self.start_channel(channel)
+        self.bot.join(channel.name)
+
+    def remove_channel(self, name: str):
+        channel = self.channels.pop("#%s" % name, None)
+        if channel is None:
+            return
+
+        for timer in channel.timers:
+            timer.stop()
+        if self.state is not None:
+            # Another worker may follow the channel from now on
+            self.state_executor.submit(self.state.save, [state.snapshot(channel)])
+        self.bot.part(channel.name)
+
+    def update_channel(self, channel: Channel, channel_config: ChannelConfig):
+        """Replace the configuration of the channel, keeping the live state
+        of its moderators and timers."""
+        previous_moderators = {type(m): m for m in channel.config.moderators}
+        for moderator in channel_config.moderators:
+            previous = previous_moderators.get(type(moderator))
+            if previous is not None:
+                moderator.inherit_state(previous)
+
+        channel.chatters.resize(
+            channel_config.max_tracked_chatters, channel_config.chatter_ttl, monotonic()
+        )
+
+        previous_timers = channel.timers
+        channel.config = channel_config
+        channel.timers = self.create_timers(channel)
+        previous_moderation = channel.moderation
+        channel.moderation = self.create_moderation(channel)
+        channel.moderation.inherit_state(previous_moderation)
+
+        for i, timer in enumerate(channel.timers):
+            if i < len(previous_timers):
+                timer.inherit_state(previous_timers[i])
+            else:
+                timer.start()
+
+        for timer in previous_timers:
+            timer.stop()
+
+    def apply_config(self, new_config: Config):
+        self.available_channels = dict(new_config.channels)
+        if self.only_channels is not None:
+            new_config.channels = {
+                name: channel_config
+                for name, channel_config in new_config.channels.items()
+                if name in self.only_channels
+            }
+
+        for name in list(self.channels):
+            if name[1:] not in new_config.channels:
+                self.remove_channel(name[1:])
+
+        for channel_config in new_config.channels.values():
+            channel = self.channels.get("#%s" % channel_config.channel)
+            if channel is None:
+                self.add_channel(channel_config)
+            else:
+                self.update_channel(channel, channel_config)
+
+        # The metrics endpoint keeps running with the previous settings
+        new_config.metrics = self.config.metrics
+        self.config = new_config
+        self.set_nb_workers(self.nb_workers)
+
+    def set_nb_workers(self, nb_workers: int):
+        """Share the rate limits of the account with the other workers."""
+        self.nb_workers = nb_workers
+        self.outbox.rate, self.outbox.period = share_rate_limit(
+            MODERATOR_RATE_LIMIT if self.config.bot_is_moderator else RATE_LIMIT,
+            RATE_LIMIT_PERIOD,
+            nb_workers,
+        )
+        self.join_rate, self.join_period = share_rate_limit(
+            JOIN_RATE_LIMIT, JOIN_RATE_LIMIT_PERIOD, nb_workers
+        )
+
+    def request_reload(self):
+        self.bot.loop.create_task(self.reload())
+
+    async def reload(self):
+        logger.info("Reloading the configuration")
+
+        try:
+            # Parse the file in a thread to avoid blocking the event loop
+            new_config = await self.bot.loop.run_in_executor(
+                None, get_config, self.config.path, self.config.digest
+            )
+        except Exception as error:
+            logger.error(
+                "The configuration could not be reloaded, keeping the current one: %s",
+                error,
+            )
+            return
+
+        if new_config is None:
+            logger.info("The configuration has not changed")
+            return
+
+        self.apply_config(new_config)
+        logger.info("Configuration reloaded")
+
+    def watch_config(self, interval: float):
+        """Reload the configuration when its file is modified."""
+        try:
+            mtime = os.stat(self.config.path).st_mtime
+        except OSError:
+            mtime = self._config_mtime
+
+        if self._config_mtime is not None and mtime != self._config_mtime:
+            self.request_reload()
+
+        self._config_mtime = mtime
+        self.bot.loop.call_later(interval, self.watch_config, interval)
+
+    def enable_state(self, path: str, interval: float):
+        """Restore the state of the channels saved in the database,
+        then save it every `interval` seconds.
+        If the database cannot be used, the bot runs without saving its state."""
+        try:
+            store = state.StateStore(path)
+        except sqlite3.Error as error:
+            logger.error(
+                "The state cannot be saved in %s, running without it: %s", path, error
+            )
+            return
+
+        try:
+            states = [
+                store.load(channel.config.channel) for channel in self.channels.values()
+            ]
+        except sqlite3.Error as error:
+            store.close()
+            logger.error(
+                "The state cannot be restored from %s, running without it: %s",
+                path,
+                error,
+            )
+            return
+
+        self.state = store
+        # A single thread, so the saves happen in order
+        self.state_executor = ThreadPoolExecutor(1, thread_name_prefix="state")
+
+        for channel, channel_state in zip(self.channels.values(), states):
+            state.restore(channel, channel_state)
+        logger.info("State restored from %s", path)
+
+        self.bot.loop.call_later(interval, self._save_state_periodically, interval)
+        # Stop cleanly on SIGTERM too, so the state is saved when the container stops
+        self.bot.loop.add_signal_handler(signal.SIGTERM, self.bot.SIGINT)
+
+    def save_state(self):
+        states = [state.snapshot(channel) for channel in self.channels.values()]
+        future = self.bot.loop.run_in_executor(
+            self.state_executor, self.state.save, states
+        )
+        future.add_done_callback(self._on_state_saved)
 
     @staticmethod
-    def _parse_variables(in_str: str, **kwargs):
-        for key in kwargs:
-            value = kwargs[key]
-            in_str = in_str.replace("{%s}" % key, value)
+    def _on_state_saved(future):
+        if future.exception() is not None:
+            logger.error("The state could not be saved: %s", future.exception())
 
-        return in_str
+    def _save_state_periodically(self, interval: float):
+        self.save_state()
+        self.bot.loop.call_later(interval, self._save_state_periodically, interval)
+
+    def close_state(self):
+        """Save the state a last time, once the bot has stopped."""
+        if self.state is None:
+            return
+
+        self.state_executor.shutdown(wait=True)
+        self.state.save([state.snapshot(channel) for channel in self.channels.values()])
+        self.state.close()
+        self.state = None
+
+    def get_stats(self) -> {str: int}:
+        # The total time spent by each moderator to vote
+        vote_durations = {}
+        for channel in self.channels.values():
+            for name, (_, duration) in channel.moderation.get_timings().items():
+                key = "vote_seconds_%s" % name.lower().replace(" ", "_")
+                vote_durations[key] = vote_durations.get(key, 0) + duration
+
+        return {
+            "channels": len(self.channels),
+            "messages": self.nb_messages,
+            "downtime": self.downtime,
+            "chatters": sum(
+                len(channel.chatters) for channel in self.channels.values()
+            ),
+            "flood_history": self.get_flood_history_size(),
+            "adaptive_channels": sum(
+                channel.moderation.adaptive for channel in self.channels.values()
+            ),
+            "commands_answered": sum(
+                sum(channel.cooldowns.answered.values())
+                for channel in self.channels.values()
+            ),
+            "commands_suppressed": sum(
+                sum(channel.cooldowns.suppressed.values())
+                for channel in self.channels.values()
+            ),
+            **vote_durations,
+            **self.outbox.get_stats(),
+        }
+
+    def get_flood_history_size(self) -> int:
+        """Return the number of messages the flood moderators remember."""
+        return sum(
+            len(channel.moderation.flood.last_msgs)
+            for channel in self.channels.values()
+            if channel.moderation.flood is not None
+        )
+
+    def get_uptime(self) -> str:
+        minutes = int(monotonic() - self.started_at) // 60
+        return "%dh%02d" % (minutes // 60, minutes % 60)
+
+    def render_command(
+        self, channel: Channel, command: Command, author: str, args: str = ""
+    ) -> str:
+        key = command.name if command.name is not None else command.message
+        count = channel.commands_count.get(key, 0) + 1
+        channel.commands_count[key] = count
+
+        values = {
+            "author": author,
+            "channel": channel.config.channel,
+            "count": count,
+            "args": args,
+            "target": args.split(" ", 1)[0].lstrip("@") if args else author,
+        }
+        if "uptime" in command.template.variables:
+            values["uptime"] = self.get_uptime()
+
+        return command.template.render(values)
+
+    @staticmethod
+    def render_moderator_message(
+        channel: Channel, moderator: Moderator, author: str
+    ) -> str:
+        return moderator.template.render(
+            {"author": author, "channel": channel.config.channel}
+        )
 
     # @irc3.event(r'^(?P<data>.+)$')
     # def on_all(self, data):
     #     print(data)
 
-    @irc3.event(irc3.rfc.PRIVMSG)
     def on_msg(
         self,
         mask: str = None,
@@ -69,121 +497,270 @@ class TwitchBot:
         tags: str = None,
         **_
     ):
-        author = mask.split("!")[0]
-        command = self.config.find_command(data.lower().split(" ")[0])
+        if not metrics.enabled:
+            self.handle_msg(mask, target, data, tags)
+            return
+
+        started_at = perf_counter()
+        metrics.LINES_RECEIVED.inc("PRIVMSG")
+        self.handle_msg(mask, target, data, tags)
+        metrics.ON_MSG_DURATION.observe(perf_counter() - started_at)
+
+    def handle_msg(self, mask: str, target: str, data: str, tags: str):
         tags_dict = utils.parse_tags(tags)
+        if self.overlap_ids is not None:
+            # Both connections receive the messages until the previous one is closed
+            msg_id = tags_dict.get("id")
+            if msg_id in self.overlap_ids:
+                return
+            self.overlap_ids.add(msg_id)
+
+        self.nb_messages += 1
+
+        channel = self.channels.get(target)
+        if channel is None:
+            return
+
+        if channel.moderation.observe():
+            self.log_adaptive_mode(channel)
+
+        chatter = channel.chatters.see(mask.split("!")[0], monotonic())
+        # Interned, like in all the structures keyed by chatter
+        author = chatter.name
+        command = None
+        if data.startswith(channel.config.command_prefix):
+            command_name, _, args = data.partition(" ")
+            command = channel.config.find_command(command_name.lower())
 
         if command is not None:
-            print("%s: %s%s" % (author, self.config.command_prefix, command.name))
-            self.bot.privmsg(
-                target, self._parse_variables(command.message, author=author)
+            answered = channel.cooldowns.hit(
+                command.name, author, command.cooldown, command.user_cooldown
             )
+            if metrics.enabled:
+                metrics.COMMANDS.inc(
+                    command.name, "answered" if answered else "suppressed"
+                )
+            if not answered:
+                logger.debug(
+                    "%s %s: %s%s (cooling down)",
+                    target,
+                    author,
+                    channel.config.command_prefix,
+                    command.name,
+                )
+            else:
+                logger.info(
+                    "%s %s: %s%s",
+                    target,
+                    author,
+                    channel.config.command_prefix,
+                    command.name,
+                )
+                self.outbox.send(
+                    target,
+                    self.render_command(channel, command, author, args.strip()),
+                    Priority.COMMAND,
+                )
         elif tags_dict.get("mod") == "0":
-            self.moderate(tags_dict, data, author, target)
+            self.moderate(channel, tags_dict, data, chatter)
 
-        self.nb_messages_since_timer += 1
-        self.play_timer()
+        for timer in channel.timers:
+            timer.on_message()
 
-    @irc3.event(twitch_message.USERNOTICE)
-    def on_user_notice(self, tags: str, **_):
-        tags = utils.parse_tags(tags)
-        if tags.get("msg-id", None) == "raid":
-            # Notice the Flood moderator a raid has just happened
-            for moderator in self.config.moderators:
-                if (
-                    isinstance(moderator, FloodModerator)
-                    and moderator.raid_cooldown is not None
-                ):
-                    print(
-                        "Raid received from %s. Disabling the Flood moderator."
-                        % tags.get("display-name")
-                    )
-                    moderator.declare_raid()
-                    break
-
-    def play_timer(self):
-        if not self.messages_stack:
-            print("Filling the timer messages stack in")
-            self.messages_stack = self.config.timer.pool.copy()
-            if self.config.timer.strategy == TimerStrategy.SHUFFLE:
-                print("Shuffle!")
-                shuffle(self.messages_stack)
+    def on_user_notice(self, tags: str = None, target: str = None, **_):
+        if metrics.enabled:
+            metrics.LINES_RECEIVED.inc("USERNOTICE")
 
-        if (
-            self.nb_messages_since_timer < self.config.timer.msgs_between
-            or datetime.now()
-            < self.last_timer_date + timedelta(minutes=self.config.timer.time_between)
-        ):
+        channel = self.channels.get(target)
+        if channel is None:
             return
 
-        command = self.messages_stack.pop(0)
-
-        print("Timer: %s" % command.message)
-        self.bot.privmsg("#%s" % self.config.channel, command.message)
+        tags = utils.parse_tags(tags)
+        if tags.get("msg-id", None) == "raid":
+            flood = channel.moderation.flood
+            if channel.moderation.declare_raid():
+                action = ", switching the moderators to adaptive mode"
+            elif flood is not None and flood.disabled_on_raid and flood.is_raided():
+                action = ", disabling the Flood moderator"
+            else:
+                action = ""
+            logger.info(
+                "%s Raid received from %s%s", target, tags.get("display-name"), action
+            )
 
-        self.nb_messages_since_timer = 0
-        self.last_timer_date = datetime.now()
+    @staticmethod
+    def log_adaptive_mode(channel: Channel):
+        moderation = channel.moderation
+        logger.info(
+            "%s %.0f messages per second, %s",
+            channel.name,
+            moderation.rate.get(moderation.clock()),
+            (
+                "switching the moderators to adaptive mode"
+                if moderation.adaptive
+                else "switching the moderators back to normal mode"
+            ),
+        )
+
+    def moderate(self, channel: Channel, tags: {str: str}, msg: str, chatter: Chatter):
+        author = chatter.name
 
-    def moderate(self, tags: {str: str}, msg: str, author: str, channel: str):
         def delete_msg(mod: Moderator):
-            print("[DELETE (reason: %s)] %s: %s" % (mod.get_name(), author, msg))
-            self.bot.privmsg(channel, "/delete %s" % tags["id"])
-
-        def timeout(mod: Moderator):
-            print("[TIMEOUT (reason: %s)] %s: %s" % (mod.get_name(), author, msg))
-            self.bot.privmsg(
-                channel,
-                "/timeout %s %d %s"
-                % (
-                    author,
-                    mod.timeout_duration,
-                    self._parse_variables(mod.message, author=author),
-                ),
+            logger.info(
+                "%s [DELETE (reason: %s)] %s: %s",
+                channel.name,
+                mod.get_name(),
+                author,
+                msg,
+            )
+            if channel.moderation.adaptive:
+                self.outbox.delete(channel.name, author, tags["id"])
+            else:
+                self.outbox.send(
+                    channel.name, "/delete %s" % tags["id"], Priority.MODERATION
+                )
+
+        def timeout(mod: Moderator, duration: int):
+            logger.info(
+                "%s [TIMEOUT %ds (reason: %s)] %s: %s",
+                channel.name,
+                duration,
+                mod.get_name(),
+                author,
+                msg,
+            )
+            self.outbox.timeout(
+                channel.name,
+                author,
+                duration,
+                self.render_moderator_message(channel, mod, author),
             )
 
         # Ignore emotes-only messages
         if tags.get("emote-only", "0") == "1":
             return
 
-        message_to_moderate = msg
+        def apply(moderator: Moderator, vote: ModerationDecision):
+            # The channel may have been left while an offloaded vote was running
+            if self.channels.get(channel.name) is not channel:
+                return
+
+            duration = moderator.timeout_duration
+            if channel.config.strikes is not None:
+                vote, duration = channel.config.strikes.strike(
+                    chatter, vote, duration, monotonic()
+                )
 
-        # Remove emotes from message before moderating
-        for emote in tags.get("emotes", "").split("/"):
-            if emote == "":
-                break
-
-            for indices in emote.split(":")[1].split(","):
-                [first, last] = indices.split("-")
-                first, last = int(first), int(last)
-                if first == 0:
-                    message_to_moderate = message_to_moderate[last + 1 :]
-                else:
-                    message_to_moderate = (
-                        message_to_moderate[: first - 1]
-                        + message_to_moderate[last + 1 :]
-                    )
-
-        for moderator in self.config.moderators:
-            vote = moderator.vote(message_to_moderate, author)
-            if vote == ModerationDecision.ABSTAIN:
-                continue
             if vote == ModerationDecision.DELETE_MSG:
                 delete_msg(moderator)
             if vote == ModerationDecision.TIMEOUT_USER:
-                timeout(moderator)
+                timeout(moderator, duration)
 
-            self.bot.privmsg(
-                channel, self._parse_variables(moderator.message, author=author)
+            self.outbox.send(
+                channel.name,
+                self.render_moderator_message(channel, moderator, author),
+                Priority.COMMAND,
             )
-            break
 
-    @irc3.event(irc3.rfc.JOIN)
+        # Remove emotes from message before moderating
+        message_to_moderate = utils.remove_emotes(msg, tags.get("emotes"))
+
+        channel.moderation.moderate(message_to_moderate, author, apply)
+
     def on_join(self, mask, channel, **_):
-        print("JOINED %s as %s" % (channel, mask))
+        if metrics.enabled:
+            metrics.LINES_RECEIVED.inc("JOIN")
+        logger.info("JOINED %s as %s", channel, mask)
+
+        if (
+            self.pending_joins is not None
+            and mask.nick.lower() == self.bot.nick.lower()
+        ):
+            self.pending_joins.discard(channel)
+            if not self.pending_joins:
+                self.on_session_ready()
+
+    def on_twitch_reconnect(self, **_):
+        logger.info("Twitch is going to close the connection, opening a new one")
+        self.overlap_ids = set()
+        self.suspend_sending()
+        self.bot.replace_connection()
 
-    @irc3.event(irc3.rfc.CONNECTED)
     def on_connected(self, **_):
-        for line in ["CAP REQ :twitch.tv/commands", "CAP REQ :twitch.tv/tags"]:
-            self.bot.send_line(line)
+        if self.startup is not None:
+            self.startup.step("login")
+
+        # Skip irc3's flood protection queue, which would only send
+        # a line per second after the first ones
+        self.bot.send_line("CAP REQ :twitch.tv/commands twitch.tv/tags", nowait=True)
+
+        self.pending_joins = set(self.channels)
+        if self._join_timeout is not None:
+            self._join_timeout.cancel()
+        if self._next_joins is not None:
+            self._next_joins.cancel()
+
+        channels = list(self.channels)
+        # The channels that exceed the rate limit are joined later
+        delayed_batches = max(0, len(channels) - 1) // self.join_rate
+        self._join_timeout = self.bot.loop.call_later(
+            JOIN_TIMEOUT + delayed_batches * self.join_period,
+            self.on_session_ready,
+        )
+        self.join_channels(channels)
+
+    def join_channels(self, channels: [str]):
+        """Join the channels in as few lines as possible, without exceeding
+        Twitch's rate limit."""
+        self._next_joins = None
+        if not channels:
+            return
+
+        batch = channels[: self.join_rate]
+        self.bot.send_line("JOIN %s" % ",".join(batch), nowait=True)
+
+        if len(channels) > self.join_rate:
+            self._next_joins = self.bot.loop.call_later(
+                self.join_period,
+                self.join_channels,
+                channels[self.join_rate :],
+            )
+
 
-        self.bot.join("#%s" % self.config.channel)
+def create_bot(bot_config: Config, server: (str, int, bool) = None) -> irc3.IrcBot:
+    """Create the bot, connecting to Twitch's chat unless another server
+    is given, as (host, port, whether to use TLS)."""
+    global config
+    config = bot_config
+
+    host, port, ssl = (
+        server if server is not None else (TWITCH_IRC_SERVER, TWITCH_IRC_PORT, True)
+    )
+    bot = TwitchIrcBot.from_config(
+        {
+            "nick": config.nickname,
+            "password": config.token,
+            "host": host,
+            "port": port,
+            "ssl": ssl,
+            "connection": TwitchConnection,
+            # The outbox already splits the messages at Twitch's limit, which
+            # does not count the "PRIVMSG #channel :" prefix irc3 counts
+            "max_length": MAX_MESSAGE_LENGTH + 64,
+            # irc3's core plugin answers the pings and detects the lag
+            "includes": ["irc3.plugins.core"],
+        }
+    )
+
+    # Attach the events of the plugin directly, instead of letting irc3
+    # scan this module for them
+    plugin = bot.get_plugin(TwitchBot)
+    bot.attach_events(
+        irc3.event(irc3.rfc.PRIVMSG, plugin.on_msg),
+        irc3.event(twitch_message.USERNOTICE, plugin.on_user_notice),
+        irc3.event(irc3.rfc.JOIN, plugin.on_join),
+        irc3.event(twitch_message.RECONNECT, plugin.on_twitch_reconnect),
+        irc3.event(irc3.rfc.CONNECTED, plugin.on_connected),
+    )
+
+    return bot
@@ -1,9 +1,116 @@
 #!/usr/bin/env python3
 
+import re
 
-def parse_tags(tags_str: str) -> {str: str}:
-    tags_list = []
-    for tag in tags_str.split(";"):
-        tags_list.append((tag.split("=")))
+from collections.abc import Mapping
+from functools import lru_cache
 
-    return dict(tags_list)
+TAG_ESCAPE = re.compile(r"\\(.?)")
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescape_tag_value(value: str) -> str:
+    if "\\" not in value:
+        return value
+
+    return TAG_ESCAPE.sub(lambda m: TAG_ESCAPES.get(m[1], m[1]), value)
+
+
+class Tags(Mapping):
+    """The IRCv3 tags of a message.
+
+    The tags string is only searched when a tag is read, and only the tags
+    that are read get unescaped.
+    """
+
+    __slots__ = ("_raw", "_cache")
+
+    def __init__(self, tags_str: str):
+        self._raw = ";%s" % tags_str if tags_str else ""
+        self._cache = {}
+
+    def __getitem__(self, key: str) -> str:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def get(self, key: str, default=None):
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+
+        raw = self._raw
+        needle = ";" + key
+        # When a tag is repeated, the last value wins
+        start = raw.rfind(needle)
+        while start != -1:
+            end = start + len(needle)
+            if end == len(raw) or raw[end] == ";":
+                value = ""
+                break
+            if raw[end] == "=":
+                stop = raw.find(";", end)
+                value = raw[end + 1 : stop] if stop != -1 else raw[end + 1 :]
+                if "\\" in value:
+                    value = unescape_tag_value(value)
+                break
+            start = raw.rfind(needle, 0, start)
+        else:
+            return default
+
+        self._cache[key] = value
+        return value
+
+    def _keys(self) -> [str]:
+        if not self._raw:
+            return []
+
+        return [tag.split("=", 1)[0] for tag in self._raw[1:].split(";")]
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self._keys()))
+
+    def __len__(self) -> int:
+        return len(dict.fromkeys(self._keys()))
+
+
+def parse_tags(tags_str: str) -> Tags:
+    return Tags(tags_str)
+
+
+@lru_cache(maxsize=1024)
+def parse_emotes(emotes_str: str) -> ((int, int),):
+    """Parse the emotes tag of a message into sorted (start, end) ranges.
+
+    The tag looks like "25:0-4,12-16/1902:6-10": the positions are code point
+    indices in the message, which is what Python strings are indexed with.
+    The end of the returned ranges is exclusive.
+    """
+    spans = []
+    for emote in emotes_str.split("/"):
+        if emote == "":
+            continue
+
+        for indices in emote.split(":", 1)[1].split(","):
+            first, last = indices.split("-")
+            spans.append((int(first), int(last) + 1))
+
+    spans.sort()
+    return tuple(spans)
+
+
+def remove_emotes(msg: str, emotes_str: str) -> str:
+    if not emotes_str:
+        return msg
+
+    parts = []
+    position = 0
+    for first, last in parse_emotes(emotes_str):
+        if first > position:
+            parts.append(msg[position:first])
+        position = max(position, last)
+    parts.append(msg[position:])
+
+    return "".join(parts)